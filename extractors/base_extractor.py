@@ -3,17 +3,108 @@ Classe astratta base per tutti gli estrattori di fatture.
 Ogni estrattore specifico (IP, Esso, Q8) deve implementare questi metodi.
 """
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from itertools import islice
+from threading import Lock
 from typing import List, Dict, Any
+from weakref import WeakKeyDictionary
 import pdfplumber
 from models.invoice_models import Transaction, InvoiceData, ExtractionResult
 from datetime import datetime
 
+# PyMuPDF estrae il testo in C: tipicamente 10-30x più veloce di pdfplumber
+# per identificazione fornitore e intestazione. Solo testo: per le parole
+# l'ordine con cui PyMuPDF restituisce i bounding box NON ricostruisce le
+# stesse righe visuali del clustering dei caratteri di pdfplumber (su queste
+# fatture le colonne tornano raggruppate e i regex di transazione non
+# matchano più), quindi extract_words resta su pdfplumber.
+# Dipendenza opzionale: senza, si ricade su pdfplumber anche per il testo.
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+# Tabella di traduzione per numeri in formato europeo (1.234,56 → 1234.56):
+# un singolo passaggio C-level invece di due str.replace
+_NUM_TRANS = str.maketrans({'.': '', ',': '.'})
+
+# Testo completo per oggetto PDF aperto, condiviso tra identificazione,
+# header e transazioni. Chiavi weak: la entry sparisce alla chiusura del PDF,
+# e il riuso di un'istanza estrattore su un altro PDF non legge testo stantio.
+_PDF_TEXT_CACHE = WeakKeyDictionary()
+
+# Documento pymupdf parallelo per oggetto pdfplumber aperto: aperto una sola
+# volta sugli stessi bytes e chiuso automaticamente quando il PDF sparisce.
+# Il lock serializza il check-then-set (e l'apertura) tra thread: un Document
+# pymupdf non è thread-safe.
+_FITZ_CACHE = WeakKeyDictionary()
+_FITZ_LOCK = Lock()
+
+
+def _fitz_doc(pdf):
+    """Documento pymupdf parallelo all'oggetto pdfplumber, o None"""
+    with _FITZ_LOCK:
+        doc = _FITZ_CACHE.get(pdf)
+        if doc is None:
+            stream = getattr(pdf, "stream", None)
+            if stream is None:
+                return None
+            stream.seek(0)
+            doc = pymupdf.open(stream=stream.read(), filetype="pdf")
+            _FITZ_CACHE[pdf] = doc
+    return doc
+
+
+def _extract_page_text(page) -> str:
+    """Testo della pagina: pymupdf (C) se disponibile, altrimenti pdfplumber"""
+    if pymupdf is not None:
+        doc = _fitz_doc(page.pdf)
+        if doc is not None:
+            return doc[page.page_number - 1].get_text()
+    return page.extract_text()
+
+
+class _PageCache:
+    """
+    Cache per-pagina dei risultati di extract_text/extract_words.
+    Il passaggio header (testo) e quello transazioni (parole) condividono
+    i risultati invece di ri-analizzare la stessa pagina con pdfplumber.
+    """
+
+    def __init__(self):
+        self._text = {}
+        self._words = {}
+
+    def text(self, page) -> str:
+        """Testo della pagina, estratto una sola volta"""
+        key = id(page)
+        if key not in self._text:
+            self._text[key] = _extract_page_text(page)
+        return self._text[key]
+
+    def words(self, page, **opts) -> list:
+        """Parole della pagina, estratte una sola volta per combinazione di opzioni"""
+        key = (id(page), tuple(sorted(opts.items())))
+        if key not in self._words:
+            self._words[key] = page.extract_words(**opts)
+        return self._words[key]
+
+    def drop_words(self, page):
+        """Scarta le parole di una pagina ormai processata (riduce il picco RSS)"""
+        page_key = id(page)
+        for key in [k for k in self._words if k[0] == page_key]:
+            del self._words[key]
+
 
 class BaseExtractor(ABC):
     """Classe astratta per l'estrazione dati da fatture PDF"""
 
     def __init__(self):
         self.fornitore = "UNKNOWN"
+        # Cache per-pagina condivisa tra i passaggi di estrazione
+        self._page_cache = _PageCache()
 
     @abstractmethod
     def can_handle(self, pdf_text: str) -> bool:
@@ -67,59 +158,91 @@ class BaseExtractor(ABC):
             ExtractionResult con tutti i dati estratti
         """
         try:
+            # Avvolgi i bytes grezzi una sola volta: evita il wrapping interno
+            # ripetuto di pdfplumber
+            if isinstance(pdf_content, (bytes, bytearray)):
+                pdf_content = BytesIO(pdf_content)
+
             with pdfplumber.open(pdf_content) as pdf:
-                # Estrai intestazione
-                header = self.extract_invoice_header(pdf)
-
-                # Estrai transazioni
-                transactions = self.extract_transactions(pdf)
-
-                # Crea oggetto InvoiceData
-                invoice_data = InvoiceData(
-                    numero_fattura=header.get("numero_fattura", ""),
-                    data_fattura=header.get("data_fattura", ""),
-                    fornitore=self.fornitore,
-                    cliente=header.get("cliente", ""),
-                    totale_imponibile=header.get("totale_imponibile", 0.0),
-                    totale_iva=header.get("totale_iva", 0.0),
-                    totale_fattura=header.get("totale_fattura", 0.0),
-                    transactions=transactions
-                )
-
-                # Crea risultato
-                result = ExtractionResult(
-                    status="success",
-                    filename=filename,
-                    timestamp=datetime.now().isoformat(),
-                    fornitore=self.fornitore,
-                    invoice_data=invoice_data,
-                    records_count=len(transactions),
-                    total_amount=header.get("totale_fattura", 0.0)
-                )
-
-                return result
+                return self.extract_from_open_pdf(pdf, filename)
 
         except Exception as e:
             # In caso di errore, restituisci un risultato con errore
-            return ExtractionResult(
-                status="error",
+            return self._error_result(filename, e)
+
+    def extract_from_open_pdf(self, pdf, filename: str, pdf_text: str = None) -> ExtractionResult:
+        """
+        Estrae tutti i dati da un PDF già aperto con pdfplumber.
+        Permette alla Factory di riusare lo stesso oggetto PDF (e il testo già
+        estratto) tra identificazione, header e transazioni senza ri-parsare.
+
+        Args:
+            pdf: Oggetto pdfplumber PDF già aperto
+            filename: Nome del file
+            pdf_text: Testo completo già estratto dal PDF (opzionale)
+
+        Returns:
+            ExtractionResult con tutti i dati estratti
+        """
+        try:
+            if pdf_text is not None:
+                _PDF_TEXT_CACHE[pdf] = pdf_text
+
+            # Estrai intestazione
+            header = self.extract_invoice_header(pdf)
+
+            # Estrai transazioni
+            transactions = self.extract_transactions(pdf)
+
+            # Crea oggetto InvoiceData
+            invoice_data = InvoiceData(
+                numero_fattura=header.get("numero_fattura", ""),
+                data_fattura=header.get("data_fattura", ""),
+                fornitore=self.fornitore,
+                cliente=header.get("cliente", ""),
+                totale_imponibile=header.get("totale_imponibile", 0.0),
+                totale_iva=header.get("totale_iva", 0.0),
+                totale_fattura=header.get("totale_fattura", 0.0),
+                transactions=transactions
+            )
+
+            # Crea risultato
+            result = ExtractionResult(
+                status="success",
                 filename=filename,
                 timestamp=datetime.now().isoformat(),
                 fornitore=self.fornitore,
-                invoice_data=InvoiceData(
-                    numero_fattura="",
-                    data_fattura="",
-                    fornitore=self.fornitore,
-                    cliente="",
-                    totale_imponibile=0.0,
-                    totale_iva=0.0,
-                    totale_fattura=0.0
-                ),
-                records_count=0,
-                total_amount=0.0,
-                message=f"Errore durante l'estrazione: {str(e)}"
+                invoice_data=invoice_data,
+                records_count=len(transactions),
+                total_amount=header.get("totale_fattura", 0.0)
             )
 
+            return result
+
+        except Exception as e:
+            return self._error_result(filename, e)
+
+    def _error_result(self, filename: str, error: Exception) -> ExtractionResult:
+        """Costruisce un ExtractionResult di errore standardizzato"""
+        return ExtractionResult(
+            status="error",
+            filename=filename,
+            timestamp=datetime.now().isoformat(),
+            fornitore=self.fornitore,
+            invoice_data=InvoiceData(
+                numero_fattura="",
+                data_fattura="",
+                fornitore=self.fornitore,
+                cliente="",
+                totale_imponibile=0.0,
+                totale_iva=0.0,
+                totale_fattura=0.0
+            ),
+            records_count=0,
+            total_amount=0.0,
+            message=f"Errore durante l'estrazione: {str(error)}"
+        )
+
     @staticmethod
     def normalizza_prodotto(stringa: str) -> str:
         """Normalizza il nome prodotto: strip + uppercase."""
@@ -136,23 +259,80 @@ class BaseExtractor(ABC):
         Returns:
             Numero convertito
         """
+        if not stringa:
+            return 0.0
         try:
-            if not stringa or stringa == '':
-                return 0.0
-            # Rimuovi spazi
-            stringa = stringa.strip()
-            # Rimuovi punti (separatori migliaia)
-            stringa = stringa.replace('.', '')
-            # Sostituisci virgola con punto (separatore decimale)
-            stringa = stringa.replace(',', '.')
-            return float(stringa)
-        except:
+            # Rimuovi punti (migliaia) e converti la virgola decimale in un solo passaggio
+            return float(stringa.strip().translate(_NUM_TRANS))
+        except ValueError:
             return 0.0
 
     @staticmethod
-    def get_pdf_text(pdf) -> str:
+    def normalizza_numeri(*stringhe) -> tuple:
         """
-        Estrae tutto il testo dal PDF.
+        Converte più stringhe numeriche in formato europeo in una sola chiamata.
+        Nei parser di riga ammortizza l'overhead Python per-chiamata sui
+        3-4 campi numerici di ogni transazione.
+
+        Args:
+            stringhe: Stringhe da convertire
+
+        Returns:
+            Tupla di float, nello stesso ordine degli argomenti
+        """
+        trans = _NUM_TRANS
+        valori = []
+        for stringa in stringhe:
+            if not stringa:
+                valori.append(0.0)
+                continue
+            try:
+                valori.append(float(stringa.strip().translate(trans)))
+            except ValueError:
+                valori.append(0.0)
+        return tuple(valori)
+
+    def _iter_page_words(self, pages, **opts):
+        """
+        Itera (page, words) prefetchando extract_words della pagina successiva
+        in un thread separato mentre le righe della pagina corrente vengono
+        analizzate. pdfplumber rilascia il GIL nelle fasi C-heavy, quindi il
+        parsing regex e la decompressione della pagina dopo si sovrappongono.
+
+        Args:
+            pages: Sequenza di pagine pdfplumber
+            opts: Opzioni passate a extract_words
+
+        Yields:
+            Tuple (page, words)
+        """
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Le pagine solo-immagine (scansioni/fax) non hanno oggetti testo:
+            # page.chars è economico e salta il costo di extract_words
+            pages_iter = (page for page in pages if page.chars)
+            in_volo = deque()
+
+            # Prefetch delle prime due pagine
+            for page in islice(pages_iter, 2):
+                in_volo.append((page, executor.submit(self._page_cache.words, page, **opts)))
+
+            while in_volo:
+                page, future = in_volo.popleft()
+                prossima = next(pages_iter, None)
+                if prossima is not None:
+                    in_volo.append(
+                        (prossima, executor.submit(self._page_cache.words, prossima, **opts))
+                    )
+                yield page, future.result()
+                # Il consumatore ha finito la pagina: rilascia le parole
+                # memorizzate e le cache interne di pdfplumber (char/oggetti),
+                # che altrimenti restano vive per tutto il documento
+                self._page_cache.drop_words(page)
+                page.flush_cache()
+
+    def get_pdf_text(self, pdf) -> str:
+        """
+        Estrae tutto il testo dal PDF, riusando il testo in cache se disponibile.
 
         Args:
             pdf: Oggetto pdfplumber PDF
@@ -160,7 +340,13 @@ class BaseExtractor(ABC):
         Returns:
             Testo completo del PDF
         """
+        cached = _PDF_TEXT_CACHE.get(pdf)
+        if cached is not None:
+            return cached
+
         text = ""
         for page in pdf.pages:
-            text += page.extract_text() or ""
+            text += self._page_cache.text(page) or ""
+
+        _PDF_TEXT_CACHE[pdf] = text
         return text
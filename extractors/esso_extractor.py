@@ -3,37 +3,57 @@ Estrattore per fatture WEX (ex Esso) — WEX Europe Services SRL.
 """
 import re
 from typing import List, Dict, Any
-from collections import defaultdict
+from itertools import groupby
 from .base_extractor import BaseExtractor
 from models.invoice_models import Transaction
 
+# Pattern compilati a livello di modulo: evitano il lookup nella cache di re
+# ad ogni riga/chiamata (hot loop su PDF multi-pagina)
+#
+# Formato WEX:
+# DD.MM.YY TICKET DI <7-digit-code><LOCALITY NAME> TARGA [KM] prodotto qty ...
+# Esempio: 03.04.26 001621 DI 1452020MAGLIANO EM647VW 385756 gasolio autotrazion 122,18 263,79 ...
+# Esempio (senza KM): 13.04.26 007089 DI 1451479RIGNANO F FS549TP gasolio autotrazion 41,39 91,02 ...
+_TXN_RE = re.compile(
+    r"(\d{2}\.\d{2}\.\d{2})\s+"            # Data DD.MM.YY       (gruppo 1)
+    r"(\d{5,6})\s+"                         # Ticket              (gruppo 2)
+    r"DI\s+"                                # Literal "DI"
+    r"\d{7}"                                # Codice località (non catturato)
+    r"([A-Z][A-Z ]*?)\s+"                   # Nome località       (gruppo 3)
+    r"([A-Z]{2}\d{3}[A-Z]{2})\s+"          # Targa               (gruppo 4)
+    r"(?:(\d+)\s+)?"                        # KM opzionale        (gruppo 5)
+    r"([A-Za-z]\S*(?:\s+[A-Za-z.]\S*)?)\s+"  # Prodotto 1-2 parole (gruppo 6)
+    r"([\d,]+)",                            # Quantità            (gruppo 7)
+    re.IGNORECASE
+)
+# Alternation unica per l'header: una sola scansione del testo invece di
+# una re.search per campo, con dispatch su m.lastgroup
+_HDR_RE = re.compile(
+    r"Fattura No\s*:\s*(?P<nr>\d+)"
+    r"|Data\s*:\s*(?P<data>\d{2}\.\d{2}\.\d{4})"
+    r"|TOTALE:\s*(?P<imponibile>[\d.,]+)\s*(?P<iva>[\d.,]+)\s*(?P<totale>[\d.,]+)",
+    re.IGNORECASE
+)
+_IMPORTI_RE = re.compile(r"[\d,]+")
+# Hint economico per il prefiltro transazioni: la firma data DD.MM.YY ovunque
+# nella riga. Deve essere permissivo almeno quanto _TXN_RE (search non
+# ancorato): la ricostruzione delle righe può anteporre token spuri alla data
+_DATE_HINT_RE = re.compile(r"\d{2}\.\d{2}\.\d{2}")
+
 
 class EssoExtractor(BaseExtractor):
     """Estrattore per fatture WEX Europe Services (ex Esso)"""
 
+    # Indicatori ordinati per selettività: il più specifico per primo
+    INDICATORS = ("WEX Europe Services", "ESSO CARD", "essocard")
+
     def __init__(self):
         super().__init__()
         self.fornitore = "WEX"
-        # Formato WEX:
-        # DD.MM.YY TICKET DI <7-digit-code><LOCALITY NAME> TARGA [KM] prodotto qty ...
-        # Esempio: 03.04.26 001621 DI 1452020MAGLIANO EM647VW 385756 gasolio autotrazion 122,18 263,79 ...
-        # Esempio (senza KM): 13.04.26 007089 DI 1451479RIGNANO F FS549TP gasolio autotrazion 41,39 91,02 ...
-        self._pattern_transazione = re.compile(
-            r"(\d{2}\.\d{2}\.\d{2})\s+"            # Data DD.MM.YY       (gruppo 1)
-            r"(\d{5,6})\s+"                         # Ticket              (gruppo 2)
-            r"DI\s+"                                # Literal "DI"
-            r"\d{7}"                                # Codice località (non catturato)
-            r"([A-Z][A-Z ]*?)\s+"                   # Nome località       (gruppo 3)
-            r"([A-Z]{2}\d{3}[A-Z]{2})\s+"          # Targa               (gruppo 4)
-            r"(?:(\d+)\s+)?"                        # KM opzionale        (gruppo 5)
-            r"([A-Za-z]\S*(?:\s+[A-Za-z.]\S*)?)\s+"  # Prodotto 1-2 parole (gruppo 6)
-            r"([\d,]+)",                            # Quantità            (gruppo 7)
-            re.IGNORECASE
-        )
+        self._pattern_transazione = _TXN_RE
 
     def can_handle(self, pdf_text: str) -> bool:
-        indicators = ["WEX Europe Services", "ESSO CARD", "essocard"]
-        return any(indicator in pdf_text for indicator in indicators)
+        return any(indicator in pdf_text for indicator in self.INDICATORS)
 
     def extract_invoice_header(self, pdf) -> Dict[str, Any]:
         text = self.get_pdf_text(pdf)
@@ -47,55 +67,68 @@ class EssoExtractor(BaseExtractor):
             "totale_fattura": 0.0
         }
 
-        match_nr = re.search(r"Fattura No\s*:\s*(\d+)", text, re.IGNORECASE)
-        if match_nr:
-            header["numero_fattura"] = match_nr.group(1)
-
-        match_data = re.search(r"Data\s*:\s*(\d{2}\.\d{2}\.\d{4})", text)
-        if match_data:
-            header["data_fattura"] = match_data.group(1).replace('.', '/')
-
-        match_totale = re.search(r"TOTALE:\s*([\d.,]+)\s*([\d.,]+)\s*([\d.,]+)", text)
-        if match_totale:
-            header["totale_imponibile"] = self.normalizza_numero(match_totale.group(1))
-            header["totale_iva"] = self.normalizza_numero(match_totale.group(2))
-            header["totale_fattura"] = self.normalizza_numero(match_totale.group(3))
+        # Una sola scansione in avanti: il primo match per campo vince
+        for m in _HDR_RE.finditer(text):
+            if m.lastgroup == "nr" and not header["numero_fattura"]:
+                header["numero_fattura"] = m.group("nr")
+            elif m.lastgroup == "data" and not header["data_fattura"]:
+                header["data_fattura"] = m.group("data").replace('.', '/')
+            elif m.lastgroup == "totale" and not header["totale_fattura"]:
+                header["totale_imponibile"] = self.normalizza_numero(m.group("imponibile"))
+                header["totale_iva"] = self.normalizza_numero(m.group("iva"))
+                header["totale_fattura"] = self.normalizza_numero(m.group("totale"))
 
         return header
 
     def extract_transactions(self, pdf) -> List[Transaction]:
-        transactions = []
+        # Accumula i dict deduplicati e costruisci i Transaction in un unico
+        # passaggio finale (niente oggetti nel loop caldo)
+        raccolti = []
         visti = set()
 
-        for page in pdf.pages:
-            words = page.extract_words(
-                x_tolerance=3,
-                y_tolerance=3,
-                keep_blank_chars=False,
-                use_text_flow=True
-            )
-
-            righe = defaultdict(list)
-            for w in words:
-                righe[round(w["top"])].append(w["text"])
-
-            for top in sorted(righe.keys()):
-                line = " ".join(righe[top]).strip()
+        # Pipeline a due stadi: il prefetch di extract_words della pagina
+        # successiva si sovrappone al parsing delle righe correnti
+        # use_text_flow: come per IP, i fogli WEX possono ridisegnare righe a
+        # coordinate sovrapposte e il flow ordering cambia anche la
+        # segmentazione delle parole, non solo l'ordine
+        for page, words in self._iter_page_words(
+            pdf.pages,
+            x_tolerance=3,
+            y_tolerance=3,
+            keep_blank_chars=False,
+            use_text_flow=True
+        ):
+
+            # Un solo sort + groupby invece di dict di liste, preservando
+            # l'ordine orizzontale delle parole
+            words.sort(key=lambda w: (round(w["top"]), w["x0"]))
+
+            for top, grp in groupby(words, key=lambda w: round(w["top"])):
+                line = " ".join(w["text"] for w in grp).strip()
                 if not line:
                     continue
 
+                # Prefiltro economico: una riga transazione WEX contiene una
+                # data DD.MM.YY (non necessariamente a inizio riga). Evita di
+                # invocare il regex pesante sulle altre righe.
+                if len(line) < 20 or _DATE_HINT_RE.search(line) is None:
+                    continue
+
                 match_txn = self._pattern_transazione.search(line)
                 if match_txn:
                     try:
                         trans_dict = self._parse_transaction(match_txn, line)
-                        key = (trans_dict["data"], trans_dict["ora"], trans_dict["numero_scontrino"])
+                        # Chiave singola: un solo hash invece dei tre della tupla
+                        key = f"{trans_dict['data']}|{trans_dict['ora']}|{trans_dict['numero_scontrino']}"
                         if key not in visti:
                             visti.add(key)
-                            transactions.append(Transaction(**trans_dict))
+                            raccolti.append(trans_dict)
                     except Exception:
                         continue
 
-        return transactions
+        # model_construct salta la validazione pydantic: i campi sono già
+        # sanitizzati dal regex e dai normalizzatori
+        return [Transaction.model_construct(**trans_dict) for trans_dict in raccolti]
 
     def _parse_transaction(self, match, line: str) -> Dict[str, Any]:
         data_raw = match.group(1)
@@ -110,9 +143,15 @@ class EssoExtractor(BaseExtractor):
         quantita_raw = match.group(7)
         quantita = self.normalizza_numero(quantita_raw)
 
-        # Ultimo importo nella riga = Totale incl. IVA
-        importi = re.findall(r"[\d,]+", line)
-        importo = self.normalizza_numero(importi[-1]) if importi else 0.0
+        # Ultimo importo nella riga = Totale incl. IVA. Il layout WEX mette il
+        # totale come ultimo token: rsplit è una scansione C da destra, molto
+        # più economica del regex. Il finditer resta come fallback.
+        importo = self.normalizza_numero(line.rsplit(None, 1)[-1])
+        if not importo:
+            ultimo = None
+            for m in _IMPORTI_RE.finditer(line):
+                ultimo = m
+            importo = self.normalizza_numero(ultimo.group(0)) if ultimo else 0.0
 
         prezzo_unitario = importo / quantita if quantita > 0 else 0.0
 
@@ -1,9 +1,24 @@
 """
 Factory per identificare automaticamente il tipo di fattura e restituire l'estrattore appropriato.
 """
+import hashlib
+import os
+import re
 import pdfplumber
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from io import BytesIO
-from typing import Optional
+from typing import List, Optional, Tuple
+
+# PyMuPDF è ordini di grandezza più veloce di pdfplumber per l'estrazione di
+# solo testo (niente layout/bounding box, che per l'identificazione non servono).
+# Dipendenza opzionale: senza, si ricade su pdfplumber.
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
 from .base_extractor import BaseExtractor
 from .ip_extractor import IPExtractor
 from .esso_extractor import EssoExtractor
@@ -16,13 +31,31 @@ class ExtractorFactory:
     Factory per creare l'estrattore appropriato basandosi sul contenuto del PDF.
     """
 
-    # Registra tutti gli estrattori disponibili
-    EXTRACTORS = [
+    # Registra tutti gli estrattori disponibili (tupla: il registro è fisso
+    # a import time, le tabelle di dispatch qui sotto ne derivano)
+    EXTRACTORS = (
         IPExtractor,
         EssoExtractor,
         Q8Extractor,
         TamoilExtractor
-    ]
+    )
+
+    # Mappa indicatore → classe estrattore per il dispatch diretto dopo il match
+    _INDICATOR_MAP = {
+        indicator: extractor_class
+        for extractor_class in EXTRACTORS
+        for indicator in extractor_class.INDICATORS
+    }
+
+    # Alternation unica compilata: una sola scansione del testo invece di
+    # N_estrattori × N_indicatori. Gli indicatori più lunghi vengono prima
+    # così il match è sempre quello più specifico.
+    _IDENT_RE = re.compile(
+        "|".join(
+            re.escape(indicator)
+            for indicator in sorted(_INDICATOR_MAP, key=len, reverse=True)
+        )
+    )
 
     @classmethod
     def get_extractor(cls, pdf_content: bytes) -> Optional[BaseExtractor]:
@@ -39,14 +72,9 @@ class ExtractorFactory:
             ValueError: Se non viene trovato un estrattore compatibile
         """
         try:
-            # Estrai il testo dal PDF
-            pdf_text = cls._extract_text_from_pdf(pdf_content)
-
-            # Prova ogni estrattore
-            for extractor_class in cls.EXTRACTORS:
-                extractor = extractor_class()
-                if extractor.can_handle(pdf_text):
-                    return extractor
+            extractor_class = cls._identify_class_cached(pdf_content)
+            if extractor_class is not None:
+                return extractor_class()
 
             # Nessun estrattore trovato
             raise ValueError(
@@ -57,22 +85,106 @@ class ExtractorFactory:
         except Exception as e:
             raise ValueError(f"Errore nell'identificazione del tipo di fattura: {str(e)}")
 
+    # Cache LRU (hash del contenuto → classe estrattore): retry, riprocessi e
+    # test ricaricano spesso lo stesso PDF, e un hash costa molto meno di un
+    # open pdfplumber
+    _IDENT_CACHE_SIZE = 256
+    _ident_cache = OrderedDict()
+
+    @classmethod
+    def _identify_class_cached(cls, pdf_content: bytes) -> Optional[type]:
+        """
+        Come _identify_class, ma memoizzato su un hash del contenuto del PDF
+        in una cache LRU di dimensione limitata.
+
+        Args:
+            pdf_content: Contenuto binario del PDF
+
+        Returns:
+            Classe estrattore corrispondente, o None
+        """
+        key = hashlib.blake2b(pdf_content, digest_size=16).digest()
+
+        extractor_class = cls._ident_cache.get(key)
+        if extractor_class is not None:
+            cls._ident_cache.move_to_end(key)
+            return extractor_class
+
+        extractor_class = cls._identify_class(pdf_content)
+        if extractor_class is not None:
+            cls._ident_cache[key] = extractor_class
+            if len(cls._ident_cache) > cls._IDENT_CACHE_SIZE:
+                cls._ident_cache.popitem(last=False)
+
+        return extractor_class
+
+    @classmethod
+    def _identify_class(cls, pdf_content: bytes) -> Optional[type]:
+        """
+        Identifica la classe estrattore scansionando il PDF una pagina alla
+        volta, con uscita anticipata al primo indicatore trovato. Il brand è
+        in pratica sempre sulla pagina di copertina, quindi il costo tipico è
+        O(1) pagine invece che O(n).
+
+        Args:
+            pdf_content: Contenuto binario del PDF
+
+        Returns:
+            Classe estrattore corrispondente, o None
+        """
+        if pymupdf is not None:
+            doc = pymupdf.open(stream=pdf_content, filetype="pdf")
+            try:
+                for i in range(doc.page_count):
+                    match = cls._IDENT_RE.search(doc[i].get_text())
+                    if match:
+                        return cls._INDICATOR_MAP[match.group(0)]
+            finally:
+                doc.close()
+            return None
+
+        with pdfplumber.open(BytesIO(pdf_content)) as pdf:
+            for page in pdf.pages:
+                match = cls._IDENT_RE.search(page.extract_text() or "")
+                if match:
+                    return cls._INDICATOR_MAP[match.group(0)]
+
+        return None
+
     @staticmethod
-    def _extract_text_from_pdf(pdf_content: bytes) -> str:
+    def _extract_text_from_pdf(pdf_content: bytes, max_pages: int = None, stream: BytesIO = None) -> str:
         """
-        Estrae il testo completo dal PDF per l'identificazione.
+        Estrae il testo dal PDF per l'identificazione.
 
         Args:
             pdf_content: Contenuto binario del PDF
+            max_pages: Numero massimo di pagine da leggere (None = tutte)
+            stream: BytesIO già creato sul contenuto, riusato invece di
+                riallocarne uno per chiamata
 
         Returns:
-            Testo completo del PDF
+            Testo del PDF
         """
+        # Percorso veloce: PyMuPDF per il solo testo (l'identificazione non
+        # ha bisogno delle coordinate delle parole)
+        if pymupdf is not None:
+            doc = pymupdf.open(stream=pdf_content, filetype="pdf")
+            try:
+                n_pages = doc.page_count if max_pages is None else min(max_pages, doc.page_count)
+                return "\n".join(doc[i].get_text() for i in range(n_pages))
+            finally:
+                doc.close()
+
         text = ""
-        pdf_stream = BytesIO(pdf_content)
+        if stream is None:
+            pdf_stream = BytesIO(pdf_content)
+        else:
+            pdf_stream = stream
+            pdf_stream.seek(0)
 
         with pdfplumber.open(pdf_stream) as pdf:
-            for page in pdf.pages:
+            pages = pdf.pages if max_pages is None else pdf.pages[:max_pages]
+            for page in pages:
                 page_text = page.extract_text()
                 if page_text:
                     text += page_text + "\n"
@@ -91,16 +203,60 @@ class ExtractorFactory:
         Returns:
             Dizionario con i dati estratti (compatibile con l'output legacy)
         """
-        # Ottieni l'estrattore appropriato
-        extractor = cls.get_extractor(pdf_content)
-
-        # Estrai i dati
+        # Apri il PDF una sola volta: identificazione, header e transazioni
+        # condividono lo stesso oggetto pdfplumber e lo stesso testo estratto
         pdf_stream = BytesIO(pdf_content)
-        result = extractor.extract(pdf_stream, filename)
+
+        try:
+            with pdfplumber.open(pdf_stream) as pdf:
+                pdf_text = ""
+                for page in pdf.pages:
+                    page_text = page.extract_text()
+                    if page_text:
+                        pdf_text += page_text + "\n"
+
+                match = cls._IDENT_RE.search(pdf_text)
+                if match is None:
+                    raise ValueError(
+                        "Tipo di fattura non riconosciuto. "
+                        "Formati supportati: IP Plus, Esso, Q8, Tamoil"
+                    )
+
+                extractor = cls._INDICATOR_MAP[match.group(0)]()
+                result = extractor.extract_from_open_pdf(pdf, filename, pdf_text=pdf_text)
+
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Errore nell'identificazione del tipo di fattura: {str(e)}")
 
         # Converti in formato legacy per retrocompatibilità
         return cls._convert_to_legacy_format(result)
 
+    @classmethod
+    def extract_batch(cls, items: List[Tuple[bytes, str]], max_workers: int = None) -> List[dict]:
+        """
+        Estrae una lista di PDF in parallelo con un pool di processi.
+
+        L'estrazione di ogni PDF è indipendente dalle altre e domina il tempo
+        CPU (parsing pdfplumber + regex), quindi il throughput scala quasi
+        linearmente con i core disponibili.
+
+        Args:
+            items: Lista di tuple (pdf_content, filename)
+            max_workers: Numero di processi (default: os.cpu_count())
+
+        Returns:
+            Lista di dizionari in formato legacy, nello stesso ordine di items.
+            I file non riconosciuti producono un dizionario con status "error"
+            invece di interrompere il batch.
+        """
+        if not items:
+            return []
+
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            return list(executor.map(_extract_one, items, chunksize=4))
+
     @staticmethod
     def _convert_to_legacy_format(extraction_result) -> dict:
         """
@@ -139,3 +295,25 @@ class ExtractorFactory:
             "fornitore": extraction_result.fornitore,
             "message": extraction_result.message
         }
+
+
+def _extract_one(item: Tuple[bytes, str]) -> dict:
+    """
+    Worker per ExtractorFactory.extract_batch.
+    Funzione a livello di modulo (picklabile dal ProcessPoolExecutor) che non
+    solleva mai: gli errori diventano un dizionario legacy con status "error".
+    """
+    pdf_content, filename = item
+    try:
+        return ExtractorFactory.extract_from_pdf(pdf_content, filename)
+    except Exception as e:
+        return {
+            "status": "error",
+            "filename": filename,
+            "timestamp": datetime.now().isoformat(),
+            "records_count": 0,
+            "total_amount": 0.0,
+            "data": [],
+            "fornitore": None,
+            "message": str(e)
+        }
@@ -4,22 +4,49 @@ Basato sulla logica esistente del main.py originale.
 """
 import re
 from typing import List, Dict, Any
-from collections import defaultdict
+from itertools import groupby
 from .base_extractor import BaseExtractor
 from models.invoice_models import Transaction
 
+# Pattern compilati a livello di modulo: evitano il lookup nella cache di re
+# ad ogni riga processata (hot loop su PDF multi-pagina)
+_TXN_RE = re.compile(
+    r"^(\d{2}/\d{2}/\d{2})\s+"     # Data
+    r"(\d{2}:\d{2})\s+"            # Ora
+    r"(\d{8})\s+"                  # Numero scontrino
+    r"(\d{5})\s+"                  # Codice PV
+    r"(.{1,60}?)\s+"               # Località (bounded: limita il backtracking)
+    r"(\d{1,3}(?:\.\d{3})*|1)\s+"  # Chilometraggio
+    r"0000\s+"                     # Codice fisso
+    r"([A-Z]+(?:\s+[A-Z]+)?)\s+"   # Prodotto generico (es: GASOLIO, METANO, GASOLIO SELF)
+    r"([\d,]+)"                    # Quantità (litri/kg)
+)
+_TARGA_RE = re.compile(r"TARGA\s+([A-Z]{2}[0-9]{3}[A-Z]{2})")
+_IMPORTI_RE = re.compile(r"\d+,\d+")
+# Alternation unica per l'header: una sola scansione del testo invece di
+# una re.search per campo, con dispatch su m.lastgroup
+_HDR_RE = re.compile(
+    r"Nr:\s*(?P<nr>\d+)"
+    r"|Data:\s*(?P<data>\d{2}/\d{2}/\d{4})"
+    r"|Acquisti del periodo:\s*EUR\s*(?P<imponibile>[\d.,]+)"
+    r"|IVA\s*EUR\s*(?P<iva>[\d.,]+)"
+    r"|Totale Importo:\s*EUR\s*(?P<totale>[\d.,]+)"
+)
+
 
 class IPExtractor(BaseExtractor):
     """Estrattore specifico per fatture IP Plus"""
 
+    # Indicatori ordinati per selettività: il più specifico per primo
+    INDICATORS = ("IP PLUS S.R.L", "IP PLUS", "IP Plus")
+
     def __init__(self):
         super().__init__()
         self.fornitore = "IP"
 
     def can_handle(self, pdf_text: str) -> bool:
         """Verifica se il PDF è una fattura IP Plus"""
-        indicators = ["IP PLUS S.R.L", "IP PLUS", "IP Plus"]
-        return any(indicator in pdf_text for indicator in indicators)
+        return any(indicator in pdf_text for indicator in self.INDICATORS)
 
     def extract_invoice_header(self, pdf) -> Dict[str, Any]:
         """Estrae i dati dell'intestazione della fattura IP"""
@@ -34,54 +61,53 @@ class IPExtractor(BaseExtractor):
             "totale_fattura": 0.0
         }
 
-        # Estrai numero fattura
-        match_nr = re.search(r"Nr:\s*(\d+)", text)
-        if match_nr:
-            header["numero_fattura"] = match_nr.group(1)
-
-        # Estrai data fattura
-        match_data = re.search(r"Data:\s*(\d{2}/\d{2}/\d{4})", text)
-        if match_data:
-            header["data_fattura"] = match_data.group(1)
-
-        # Estrai totali
-        match_acquisti = re.search(r"Acquisti del periodo:\s*EUR\s*([\d.,]+)", text)
-        if match_acquisti:
-            header["totale_imponibile"] = self.normalizza_numero(match_acquisti.group(1))
-
-        match_iva = re.search(r"IVA\s*EUR\s*([\d.,]+)", text)
-        if match_iva:
-            header["totale_iva"] = self.normalizza_numero(match_iva.group(1))
-
-        match_totale = re.search(r"Totale Importo:\s*EUR\s*([\d.,]+)", text)
-        if match_totale:
-            header["totale_fattura"] = self.normalizza_numero(match_totale.group(1))
+        # Una sola scansione in avanti: il primo match per campo vince
+        for m in _HDR_RE.finditer(text):
+            if m.lastgroup == "nr" and not header["numero_fattura"]:
+                header["numero_fattura"] = m.group("nr")
+            elif m.lastgroup == "data" and not header["data_fattura"]:
+                header["data_fattura"] = m.group("data")
+            elif m.lastgroup == "imponibile" and not header["totale_imponibile"]:
+                header["totale_imponibile"] = self.normalizza_numero(m.group("imponibile"))
+            elif m.lastgroup == "iva" and not header["totale_iva"]:
+                header["totale_iva"] = self.normalizza_numero(m.group("iva"))
+            elif m.lastgroup == "totale" and not header["totale_fattura"]:
+                header["totale_fattura"] = self.normalizza_numero(m.group("totale"))
 
         return header
 
     def extract_transactions(self, pdf) -> List[Transaction]:
         """Estrae le transazioni dalla fattura IP"""
-        transactions = []
+        # Accumula i dict già deduplicati e costruisci i Transaction in un
+        # unico passaggio finale (stile SoA: niente oggetti nel loop caldo)
+        raccolti = []
         transazioni_in_attesa = []
         visti = set()
         targa_corrente = None
 
-        for page in pdf.pages:
-            words = page.extract_words(
-                x_tolerance=3,
-                y_tolerance=3,
-                keep_blank_chars=False,
-                use_text_flow=True
-            )
-
-            # Raggruppa parole per riga (basato su coordinata Y)
-            righe = defaultdict(list)
-            for w in words:
-                righe[round(w["top"])].append(w["text"])
+        # Pipeline a due stadi: il prefetch di extract_words della pagina
+        # successiva si sovrappone al parsing delle righe correnti
+        # use_text_flow è necessario: le righe "Totale carta ... TARGA" di
+        # queste fatture sono disegnate due volte a coordinate sovrapposte e
+        # con l'ordinamento posizionale di default i caratteri duplicati si
+        # intrecciano (la parola TARGA non viene mai ricostruita). Il flow
+        # ordering cambia anche la segmentazione delle parole, non solo
+        # l'ordine.
+        for page, words in self._iter_page_words(
+            pdf.pages,
+            x_tolerance=3,
+            y_tolerance=3,
+            keep_blank_chars=False,
+            use_text_flow=True
+        ):
+
+            # Raggruppa parole per riga (basato su coordinata Y): un solo sort
+            # + groupby invece di dict di liste, preservando l'ordine orizzontale
+            words.sort(key=lambda w: (round(w["top"]), w["x0"]))
 
             # Processa ogni riga
-            for top in sorted(righe.keys()):
-                line = " ".join(righe[top]).strip()
+            for top, grp in groupby(words, key=lambda w: round(w["top"])):
+                line = " ".join(w["text"] for w in grp).strip()
                 if not line:
                     continue
 
@@ -91,19 +117,22 @@ class IPExtractor(BaseExtractor):
                     # Assegna targa alle transazioni in attesa
                     for trans_dict in transazioni_in_attesa:
                         trans_dict["targa"] = targa
-                        key = (
-                            trans_dict["data"],
-                            trans_dict["ora"],
-                            trans_dict["numero_scontrino"]
-                        )
+                        # Chiave singola: un solo hash invece dei tre della tupla
+                        key = f"{trans_dict['data']}|{trans_dict['ora']}|{trans_dict['numero_scontrino']}"
                         if key not in visti:
                             visti.add(key)
-                            transactions.append(Transaction(**trans_dict))
+                            raccolti.append(trans_dict)
 
                     transazioni_in_attesa = []
                     targa_corrente = targa
                     continue
 
+                # Prefiltro economico: una riga transazione inizia con DD/MM/YY
+                # ed è lunga almeno 20 caratteri. Evita di invocare il regex a
+                # 9 gruppi su header, piè di pagina e righe di servizio.
+                if len(line) < 20 or line[2] != '/' or line[5] != '/' or not line[:2].isdigit():
+                    continue
+
                 # Cerca transazione
                 match_txn = self._trova_transazione(line)
                 if match_txn:
@@ -116,48 +145,42 @@ class IPExtractor(BaseExtractor):
         # Gestisci transazioni rimaste (senza targa)
         for trans_dict in transazioni_in_attesa:
             trans_dict["targa"] = "SCONOSCIUTA"
-            key = (trans_dict["data"], trans_dict["ora"], trans_dict["numero_scontrino"])
+            key = f"{trans_dict['data']}|{trans_dict['ora']}|{trans_dict['numero_scontrino']}"
             if key not in visti:
                 visti.add(key)
-                transactions.append(Transaction(**trans_dict))
+                raccolti.append(trans_dict)
 
-        return transactions
+        # model_construct salta la validazione pydantic: i campi sono già
+        # sanitizzati dal regex e dai normalizzatori
+        return [Transaction.model_construct(**trans_dict) for trans_dict in raccolti]
 
     def _trova_transazione(self, line: str):
         """Pattern regex per identificare una transazione IP"""
-        pattern = (
-            r"^(\d{2}/\d{2}/\d{2})\s+"     # Data
-            r"(\d{2}:\d{2})\s+"            # Ora
-            r"(\d{8})\s+"                  # Numero scontrino
-            r"(\d{5})\s+"                  # Codice PV
-            r"(.+?)\s+"                    # Località
-            r"(\d{1,3}(?:\.\d{3})*|1)\s+"  # Chilometraggio
-            r"0000\s+"                     # Codice fisso
-            r"([A-Z]+(?:\s+[A-Z]+)?)\s+"   # Prodotto generico (es: GASOLIO, METANO, GASOLIO SELF)
-            r"([\d,]+)"                    # Quantità (litri/kg)
-        )
-        return re.search(pattern, line)
+        return _TXN_RE.search(line)
 
     def _estrai_targa(self, line: str) -> str:
         """Estrae la targa italiana dal testo"""
-        pattern = r"TARGA\s+([A-Z]{2}[0-9]{3}[A-Z]{2})"
-        match = re.search(pattern, line)
+        match = _TARGA_RE.search(line)
         return match.group(1) if match else None
 
     def _estrai_importo_finale(self, line: str) -> float:
-        """Estrae l'importo finale dalla riga"""
-        importi = re.findall(r"\d+,\d+", line)
-        return self.normalizza_numero(importi[-1]) if importi else 0.0
+        """Estrae l'importo finale (ultimo numero) dalla riga"""
+        # finditer evita di materializzare la lista di tutti i numeri
+        # solo per prenderne l'ultimo
+        ultimo = None
+        for m in _IMPORTI_RE.finditer(line):
+            ultimo = m
+        return self.normalizza_numero(ultimo.group(0)) if ultimo else 0.0
 
     def _valida_chilometraggio(self, raw: str) -> int:
         """Valida e converte il chilometraggio"""
-        try:
-            km = int(raw.replace('.', ''))
-            if km > 10_000_000:
-                return 0
-            return km
-        except Exception:
+        # Fast path senza eccezioni: isdigit evita il costo del try/except
+        # sul percorso caldo (il regex garantisce già cifre e punti)
+        raw = raw.replace('.', '')
+        if not raw.isdigit():
             return 0
+        km = int(raw)
+        return 0 if km > 10_000_000 else km
 
     def _determina_tipo_gasolio(self, line: str) -> str:
         """Determina il tipo di gasolio"""
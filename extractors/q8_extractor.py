@@ -4,22 +4,74 @@ Gestisce il formato specifico delle fatture CartissimaQ8.
 """
 import re
 from typing import List, Dict, Any
-from collections import defaultdict
+from itertools import groupby
 from .base_extractor import BaseExtractor
 from models.invoice_models import Transaction
 
+# Pattern compilati a livello di modulo: evitano il lookup nella cache di re
+# ad ogni riga processata (hot loop su PDF multi-pagina)
+#
+# Pattern unico a gruppi nominati: cattura l'intera riga transazione in una
+# sola scansione, invece di tre passaggi separati (findall numeri + search
+# sede + search località) sullo stesso testo.
+# Esempio: 7028009864300015041 00002 02/10/25 0852 GLS 0000 000001 5817 LOC.ACQUAVIVA S.S. 4 NEROLA SF 75,00 45,76 1,639
+_TXN_PATTERN = (
+    r"^(?P<carta>\d{19})\s+"            # Numero carta (19 cifre)
+    r"(?P<ticket>\d{5})\s+"             # Numero ticket (5 cifre)
+    r"(?P<data>\d{2}/\d{2}/\d{2})\s+"  # Data (DD/MM/YY)
+    r"(?P<oh>\d{2})(?P<om>\d{2})\s+"    # Ora (HHMM, già spezzata in ore/minuti)
+    r"(?P<prod>[A-Z]{3})\s+"            # Codice prodotto (GLS, SSP, GPL, ecc.)
+    r"\d{4}\s+\d+\s+"                   # Codici fissi
+    r"(?P<sede>\d+)\s+"                 # Codice sede
+    r"(?P<localita>.+?)\s+"             # Località
+    r"(?:SF|SV|PP)\s+"                  # Tipo servizio
+    r"(?P<importo>[\d,]+)\s+"           # Importo
+    r"(?P<qta>[\d,]+)\s+"               # Volume
+    r"(?P<prezzo>[\d,]+)"               # Prezzo finale
+)
+_TXN_RE = re.compile(_TXN_PATTERN)
+_TARGA_RE = re.compile(r"TARGA/NOME\s+([A-Z]{2}\d{3}[A-Z]{2})")
+# Scanner unico su tutte le righe ricostruite: un solo finditer C su testo
+# multilinea, con dispatch sul ramo (transazione o targa) che ha fatto match
+_SCAN_RE = re.compile(
+    _TXN_PATTERN + r"|TARGA/NOME\s+(?P<targa>[A-Z]{2}\d{3}[A-Z]{2})",
+    re.MULTILINE
+)
+_NR_RE = re.compile(r"n\.\s*([A-Z0-9]+)\s+del", re.IGNORECASE)
+_DATA_RE = re.compile(r"del\s+(\d{2}/\d{2}/\d{2,4})")
+_TOTALI_RE = re.compile(
+    r"BASE IMPONIBILE\s+IVA TOTALE\s+TOTALE FATTURA\s+([\d.,]+)\s+([\d.,]+)\s+([\d.,]+)"
+)
+
+# Mappa codice prodotto → nome: costruita una volta a livello di modulo
+# invece che ad ogni riga parsata
+_PRODOTTO_MAP = {
+    "GLS": "GASOLIO",
+    "SSP": "BENZINA",
+    "GPL": "GPL",
+    "HGL": "GASOLIO PREMIUM",
+    "GEC": "GASOLIO ECOPLUS",
+    "BWR": "BENZINA 100",
+    "HBZ": "BENZINA PREMIUM"
+}
+
 
 class Q8Extractor(BaseExtractor):
     """Estrattore specifico per fatture Q8"""
 
+    # Indicatori ordinati per selettività: il più specifico per primo
+    INDICATORS = ("Kuwait Petroleum Italia", "CartissimaQ8", "Cartissima Q8", "CARTISSIMA Q8")
+    # Alternation compilata dagli indicatori: una sola scansione C del testo
+    # invece di un substring-scan Python per indicatore
+    _SIG = re.compile("|".join(re.escape(i) for i in sorted(INDICATORS, key=len, reverse=True)))
+
     def __init__(self):
         super().__init__()
         self.fornitore = "Q8"
 
     def can_handle(self, pdf_text: str) -> bool:
         """Verifica se il PDF è una fattura Q8"""
-        indicators = ["Kuwait Petroleum Italia", "CartissimaQ8", "Cartissima Q8", "CARTISSIMA Q8"]
-        return any(indicator in pdf_text for indicator in indicators)
+        return self._SIG.search(pdf_text) is not None
 
     def extract_invoice_header(self, pdf) -> Dict[str, Any]:
         """Estrae i dati dell'intestazione della fattura Q8"""
@@ -35,21 +87,18 @@ class Q8Extractor(BaseExtractor):
         }
 
         # Estrai numero fattura (formato: n. PJ10575389 del 15/10/25)
-        match_nr = re.search(r"n\.\s*([A-Z0-9]+)\s+del", text, re.IGNORECASE)
+        match_nr = _NR_RE.search(text)
         if match_nr:
             header["numero_fattura"] = match_nr.group(1)
 
         # Estrai data fattura
-        match_data = re.search(r"del\s+(\d{2}/\d{2}/\d{2,4})", text)
+        match_data = _DATA_RE.search(text)
         if match_data:
             header["data_fattura"] = match_data.group(1)
 
         # Estrai totali
         # Cerca BASE IMPONIBILE IVA TOTALE TOTALE FATTURA
-        match_totali = re.search(
-            r"BASE IMPONIBILE\s+IVA TOTALE\s+TOTALE FATTURA\s+([\d.,]+)\s+([\d.,]+)\s+([\d.,]+)",
-            text
-        )
+        match_totali = _TOTALI_RE.search(text)
         if match_totali:
             header["totale_imponibile"] = self.normalizza_numero(match_totali.group(1))
             header["totale_iva"] = self.normalizza_numero(match_totali.group(2))
@@ -59,138 +108,112 @@ class Q8Extractor(BaseExtractor):
 
     def extract_transactions(self, pdf) -> List[Transaction]:
         """Estrae le transazioni dalla fattura Q8"""
-        transactions = []
+        # Accumula i dict deduplicati e costruisci i Transaction in un unico
+        # passaggio finale (niente oggetti nel loop caldo)
+        raccolti = []
         transazioni_in_attesa = []
         visti = set()
-        targa_corrente = None
 
+        # Primo passaggio: ricostruisci le righe di tutte le pagine rilevanti
+        righe = []
         for page_num, page in enumerate(pdf.pages):
             # Le transazioni sono nella pagina 3 (indice 2)
             if page_num < 2:
                 continue
 
-            words = page.extract_words(
+            # Prefiltro con extract_text (molto più economico di extract_words
+            # con tolleranze): salta le pagine di riepilogo/condizioni che non
+            # contengono né transazioni (PAN) né righe targa
+            txt = self._page_cache.text(page) or ""
+            if "PAN" not in txt and "TARGA/NOME" not in txt:
+                page.flush_cache()
+                continue
+
+            words = self._page_cache.words(
+                page,
                 x_tolerance=3,
                 y_tolerance=3,
-                keep_blank_chars=False,
-                use_text_flow=True
+                keep_blank_chars=False
             )
 
-            # Raggruppa parole per riga
-            righe = defaultdict(list)
-            for w in words:
-                righe[round(w["top"])].append(w["text"])
-
-            # Processa ogni riga
-            for top in sorted(righe.keys()):
-                line = " ".join(righe[top]).strip()
-                if not line:
-                    continue
-
-                # Prima cerca transazioni
-                match_txn = self._trova_transazione(line)
-                if match_txn:
-                    try:
-                        trans_dict = self._parse_transaction(match_txn, line)
-                        transazioni_in_attesa.append(trans_dict)
-                    except Exception as e:
-                        continue
-
-                # Poi cerca targa (appare dopo le transazioni)
-                # Formato: "* TOTALE PAN 7028009864300015041 TARGA/NOME EL934BA *********"
-                match_targa = re.search(r"TARGA/NOME\s+([A-Z]{2}\d{3}[A-Z]{2})", line)
-                if match_targa:
-                    targa_corrente = match_targa.group(1)
-
-                    # Assegna la targa a tutte le transazioni in attesa
-                    for trans_dict in transazioni_in_attesa:
-                        trans_dict["targa"] = targa_corrente
-                        key = (
-                            trans_dict["data"],
-                            trans_dict["ora"],
-                            trans_dict["numero_scontrino"]
-                        )
-                        if key not in visti:
-                            visti.add(key)
-                            transactions.append(Transaction(**trans_dict))
-
-                    # Svuota la lista
-                    transazioni_in_attesa = []
+            # Raggruppa parole per riga (basato su coordinata Y): un solo sort
+            # + groupby invece di dict di liste, preservando l'ordine orizzontale
+            words.sort(key=lambda w: (round(w["top"]), w["x0"]))
+            for top, grp in groupby(words, key=lambda w: round(w["top"])):
+                line = " ".join(w["text"] for w in grp).strip()
+                if line:
+                    righe.append(line)
+
+            # Pagina processata: rilascia le parole memorizzate e le cache
+            # interne di pdfplumber, che altrimenti restano vive per tutto
+            # il documento
+            self._page_cache.drop_words(page)
+            page.flush_cache()
+
+        # Secondo passaggio: un solo finditer C sul testo ricostruito invece
+        # di un dispatch regex Python per riga. L'ordine del documento è
+        # preservato, quindi la riga targa segue sempre le sue transazioni.
+        for m in _SCAN_RE.finditer("\n".join(righe)):
+            if m["targa"] is None:
+                try:
+                    transazioni_in_attesa.append(self._parse_transaction(m, m.group(0)))
+                except Exception:
                     continue
+            else:
+                # Riga targa: "* TOTALE PAN 7028... TARGA/NOME EL934BA ***"
+                # Assegna la targa a tutte le transazioni in attesa
+                targa_corrente = m["targa"]
+                for trans_dict in transazioni_in_attesa:
+                    trans_dict["targa"] = targa_corrente
+                    # Chiave singola: un solo hash invece dei tre della tupla
+                    key = f"{trans_dict['data']}|{trans_dict['ora']}|{trans_dict['numero_scontrino']}"
+                    if key not in visti:
+                        visti.add(key)
+                        raccolti.append(trans_dict)
+
+                # Svuota la lista
+                transazioni_in_attesa = []
 
         # Gestisci transazioni rimaste senza targa
         for trans_dict in transazioni_in_attesa:
             trans_dict["targa"] = "SCONOSCIUTA"
-            key = (trans_dict["data"], trans_dict["ora"], trans_dict["numero_scontrino"])
+            key = f"{trans_dict['data']}|{trans_dict['ora']}|{trans_dict['numero_scontrino']}"
             if key not in visti:
                 visti.add(key)
-                transactions.append(Transaction(**trans_dict))
+                raccolti.append(trans_dict)
 
-        return transactions
+        # model_construct salta la validazione pydantic: i campi sono già
+        # sanitizzati dal regex e dai normalizzatori
+        return [Transaction.model_construct(**trans_dict) for trans_dict in raccolti]
 
     def _trova_transazione(self, line: str):
         """
         Pattern regex per identificare una transazione Q8.
         Formato esempio: 7028009864300015041 00002 02/10/25 0852 GLS 0000 000001 5817 LOC.ACQUAVIVA S.S. 4 NEROLA SF 75,00 45,76 1,639
-
-        Strategia: Cerco pattern più semplice e poi estraggo manualmente il resto
         """
-        # Pattern semplificato: numero carta, ticket, data, ora, prodotto
-        pattern = (
-            r"^(\d{19})\s+"                 # Numero carta (19 cifre)
-            r"(\d{5})\s+"                   # Numero ticket (5 cifre)
-            r"(\d{2}/\d{2}/\d{2})\s+"      # Data (DD/MM/YY)
-            r"(\d{4})\s+"                   # Ora (HHMM)
-            r"([A-Z]{3})"                   # Codice prodotto (GLS, SSP, GPL, ecc.)
-        )
-        return re.search(pattern, line)
+        return _TXN_RE.search(line)
 
     def _parse_transaction(self, match, line: str) -> Dict[str, Any]:
         """Converte il match regex in un dizionario per Transaction"""
-        numero_carta = match.group(1)
-        numero_ticket = match.group(2)
-        data = match.group(3)
-        ora_raw = match.group(4)  # HHMM
-        # Converti HHMM a HH:MM
-        ora = f"{ora_raw[:2]}:{ora_raw[2:]}"
-        codice_prodotto = match.group(5)
-
-        # Estrai i numeri dalla riga (importo, litri, prezzo)
-        # Pattern: cerco gruppi di cifre con virgola (formato europeo)
-        numeri = re.findall(r"[\d]+,[\d]+", line)
-
-        # Gli ultimi numeri nella riga sono nell'ordine:
-        # Importo, Volume, Prezzo Finale, Sconto/Premio, Prezzo Base, Importo Totale
-        # Ci interessano: Importo (indice 0), Volume (indice 1), Prezzo Finale (indice 2)
-
-        importo_raw = numeri[0] if len(numeri) > 0 else "0,00"
-        quantita_raw = numeri[1] if len(numeri) > 1 else "0,00"
-        prezzo_raw = numeri[2] if len(numeri) > 2 else "0,00"
-
-        importo = self.normalizza_numero(importo_raw)
-        quantita = self.normalizza_numero(quantita_raw)
-        prezzo_unitario = self.normalizza_numero(prezzo_raw)
-
-        # Estrai codice sede (4 cifre dopo GLS 0000 000001)
-        match_sede = re.search(r"[A-Z]{3}\s+\d{4}\s+\d+\s+(\d+)", line)
-        codice_sede = match_sede.group(1) if match_sede else "0000"
-
-        # Estrai località (tra il codice sede e SF/SV/PP)
-        # Cerco pattern: [codice_sede] [LOCALITÀ] [SF|SV|PP]
-        match_localita = re.search(rf"{codice_sede}\s+(.+?)\s+(SF|SV|PP)\s+", line)
-        localita = match_localita.group(1).strip() if match_localita else "SCONOSCIUTA"
+        campi = match.groupdict()
+
+        numero_carta = campi["carta"]
+        numero_ticket = campi["ticket"]
+        data = campi["data"]
+        # Ore e minuti già separati dal pattern: niente slicing per riga
+        ora = f"{campi['oh']}:{campi['om']}"
+        codice_prodotto = campi["prod"]
+        codice_sede = campi["sede"]
+        localita = campi["localita"].strip()
+
+        # Nell'ordine sulla riga: Importo, Volume, Prezzo Finale
+        # (seguono Sconto/Premio, Prezzo Base, Importo Totale — non servono)
+        importo, quantita, prezzo_unitario = self.normalizza_numeri(
+            campi["importo"], campi["qta"], campi["prezzo"]
+        )
 
         # Determina prodotto
-        prodotto_map = {
-            "GLS": "GASOLIO",
-            "SSP": "BENZINA",
-            "GPL": "GPL",
-            "HGL": "GASOLIO PREMIUM",
-            "GEC": "GASOLIO ECOPLUS",
-            "BWR": "BENZINA 100",
-            "HBZ": "BENZINA PREMIUM"
-        }
-        prodotto = prodotto_map.get(codice_prodotto, "GASOLIO")
+        prodotto = _PRODOTTO_MAP.get(codice_prodotto, "GASOLIO")
 
         # Km non sempre disponibile nelle fatture Q8
         km = 0
@@ -4,22 +4,59 @@ Gestisce il formato specifico delle fatture Tamoil mycard.
 """
 import re
 from typing import List, Dict, Any
-from collections import defaultdict
+from itertools import groupby
 from .base_extractor import BaseExtractor
 from models.invoice_models import Transaction
 
+# Pattern compilati a livello di modulo: evitano il lookup nella cache di re
+# ad ogni riga processata (hot loop su PDF multi-pagina)
+#
+# Formato transazione: S 8478 SACROFANO (RM) 674676 01/10/2025 09:55 1 Gasolio Self LT 61,92 101,49
+_TXN_PATTERN = (
+    r"^S\s+"                            # Nota (S = Self pre-pay)
+    r"(\d+)\s+"                         # Codice PV
+    r"([A-Z\s()]+?)\s+"                 # Località (può contenere parentesi)
+    r"(\d+)\s+"                         # N° Autorizzazione (numero scontrino)
+    r"(\d{2}/\d{2}/\d{4})\s+"          # Data (DD/MM/YYYY)
+    r"(\d{2}:\d{2})\s+"                # Ora
+    r"(\d+)\s+"                         # KM
+    r"(.+?)\s+"                         # Prodotto (es: Gasolio Self, Gasolio)
+    r"LT\s+"                            # Unità di misura (sempre LT)
+    r"([\d,]+)\s+"                      # Quantità
+    r"([\d,]+)"                         # Importo
+)
+_TXN_RE = re.compile(_TXN_PATTERN)
+_TARGA_RE = re.compile(r"Targa\s+([A-Z]{2}\d{3}[A-Z]{2})")
+# Scanner unico su tutte le righe ricostruite: un solo finditer C su testo
+# multilinea, con dispatch sul ramo (transazione o targa) che ha fatto match
+_SCAN_RE = re.compile(
+    _TXN_PATTERN + r"|Targa\s+(?P<targa>[A-Z]{2}\d{3}[A-Z]{2})",
+    re.MULTILINE
+)
+_NR_RE = re.compile(r"Fattura N[°\s]*\s*(\w+)", re.IGNORECASE)
+_DATA_RE = re.compile(r"Data fattura\s*(\d{2}/\d{2}/\d{4})")
+_CLIENTE_RE = re.compile(r"Cliente:\s*Spett\.\s*([A-Z\s]+)")
+_IMPONIBILE_RE = re.compile(r"Imponibile IVA\s*EUR\s*([\d.,]+)")
+_IVA_RE = re.compile(r"Importo IVA\s*EUR\s*([\d.,]+)")
+_TOTALE_RE = re.compile(r"Totale Fattura.*?EUR\s*([\d.,]+)")
+
 
 class TamoilExtractor(BaseExtractor):
     """Estrattore specifico per fatture Tamoil"""
 
+    # Indicatori ordinati per selettività: il più specifico per primo
+    INDICATORS = ("TAMOIL ITALIA S.p.A.", "TAMOIL", "mycard")
+    # Alternation compilata dagli indicatori: una sola scansione C del testo
+    # invece di un substring-scan Python per indicatore
+    _SIG = re.compile("|".join(re.escape(i) for i in sorted(INDICATORS, key=len, reverse=True)))
+
     def __init__(self):
         super().__init__()
         self.fornitore = "TAMOIL"
 
     def can_handle(self, pdf_text: str) -> bool:
         """Verifica se il PDF è una fattura Tamoil"""
-        indicators = ["TAMOIL ITALIA S.p.A.", "TAMOIL", "mycard"]
-        return any(indicator in pdf_text for indicator in indicators)
+        return self._SIG.search(pdf_text) is not None
 
     def extract_invoice_header(self, pdf) -> Dict[str, Any]:
         """Estrae i dati dell'intestazione della fattura Tamoil"""
@@ -35,30 +72,30 @@ class TamoilExtractor(BaseExtractor):
         }
 
         # Estrai numero fattura (formato: DA25191152)
-        match_nr = re.search(r"Fattura N[°\s]*\s*(\w+)", text, re.IGNORECASE)
+        match_nr = _NR_RE.search(text)
         if match_nr:
             header["numero_fattura"] = match_nr.group(1)
 
         # Estrai data fattura
-        match_data = re.search(r"Data fattura\s*(\d{2}/\d{2}/\d{4})", text)
+        match_data = _DATA_RE.search(text)
         if match_data:
             header["data_fattura"] = match_data.group(1)
 
         # Estrai cliente
-        match_cliente = re.search(r"Cliente:\s*Spett\.\s*([A-Z\s]+)", text)
+        match_cliente = _CLIENTE_RE.search(text)
         if match_cliente:
             header["cliente"] = match_cliente.group(1).strip()
 
         # Estrai totali
-        match_imponibile = re.search(r"Imponibile IVA\s*EUR\s*([\d.,]+)", text)
+        match_imponibile = _IMPONIBILE_RE.search(text)
         if match_imponibile:
             header["totale_imponibile"] = self.normalizza_numero(match_imponibile.group(1))
 
-        match_iva = re.search(r"Importo IVA\s*EUR\s*([\d.,]+)", text)
+        match_iva = _IVA_RE.search(text)
         if match_iva:
             header["totale_iva"] = self.normalizza_numero(match_iva.group(1))
 
-        match_totale = re.search(r"Totale Fattura.*?EUR\s*([\d.,]+)", text)
+        match_totale = _TOTALE_RE.search(text)
         if match_totale:
             header["totale_fattura"] = self.normalizza_numero(match_totale.group(1))
 
@@ -66,90 +103,90 @@ class TamoilExtractor(BaseExtractor):
 
     def extract_transactions(self, pdf) -> List[Transaction]:
         """Estrae le transazioni dalla fattura Tamoil"""
-        transactions = []
+        # Accumula i dict deduplicati e costruisci i Transaction in un unico
+        # passaggio finale (niente oggetti nel loop caldo)
+        raccolti = []
         transazioni_in_attesa = []
         visti = set()
-        targa_corrente = None
 
+        # Primo passaggio: ricostruisci le righe di tutte le pagine rilevanti
+        righe = []
         for page in pdf.pages:
-            words = page.extract_words(
+            # Prefiltro con extract_text (molto più economico di extract_words
+            # con tolleranze): salta le pagine di intestazione/riepilogo senza
+            # righe transazione ("S ..." a inizio riga) né totali carta
+            txt = self._page_cache.text(page) or ""
+            if (
+                "Targa" not in txt
+                and "Totale Carta" not in txt
+                and not txt.startswith("S ")
+                and "\nS " not in txt
+            ):
+                page.flush_cache()
+                continue
+
+            words = self._page_cache.words(
+                page,
                 x_tolerance=3,
                 y_tolerance=3,
-                keep_blank_chars=False,
-                use_text_flow=True
+                keep_blank_chars=False
             )
 
-            # Raggruppa parole per riga
-            righe = defaultdict(list)
-            for w in words:
-                righe[round(w["top"])].append(w["text"])
-
-            # Processa ogni riga
-            for top in sorted(righe.keys()):
-                line = " ".join(righe[top]).strip()
-                if not line:
+            # Raggruppa parole per riga (basato su coordinata Y): un solo sort
+            # + groupby invece di dict di liste, preservando l'ordine orizzontale
+            words.sort(key=lambda w: (round(w["top"]), w["x0"]))
+            for top, grp in groupby(words, key=lambda w: round(w["top"])):
+                line = " ".join(w["text"] for w in grp).strip()
+                if line:
+                    righe.append(line)
+
+            # Pagina processata: rilascia le parole memorizzate e le cache
+            # interne di pdfplumber, che altrimenti restano vive per tutto
+            # il documento
+            self._page_cache.drop_words(page)
+            page.flush_cache()
+
+        # Secondo passaggio: un solo finditer C sul testo ricostruito invece
+        # di un dispatch regex Python per riga. L'ordine del documento è
+        # preservato, quindi la riga "Totale Carta ... Targa XX000XX" segue
+        # sempre le sue transazioni.
+        for m in _SCAN_RE.finditer("\n".join(righe)):
+            if m["targa"] is None:
+                try:
+                    transazioni_in_attesa.append(self._parse_transaction(m, m.group(0)))
+                except Exception:
                     continue
-
-                # Cerca targa nella riga totale carta
-                # Formato: "Totale Carta 7083651392996570 Targa FK444ZJ"
-                match_targa = re.search(r"Targa\s+([A-Z]{2}\d{3}[A-Z]{2})", line)
-                if match_targa:
-                    # Assegna targa alle transazioni in attesa
-                    targa = match_targa.group(1)
-                    for trans_dict in transazioni_in_attesa:
-                        trans_dict["targa"] = targa
-                        key = (
-                            trans_dict["data"],
-                            trans_dict["ora"],
-                            trans_dict["numero_scontrino"]
-                        )
-                        if key not in visti:
-                            visti.add(key)
-                            transactions.append(Transaction(**trans_dict))
-
-                    transazioni_in_attesa = []
-                    targa_corrente = targa
-                    continue
-
-                # Cerca transazioni
-                # Formato: S 8478 SACROFANO (RM) 674676 01/10/2025 09:55 1 Gasolio Self LT 61,92 101,49
-                match_txn = self._trova_transazione(line)
-                if match_txn:
-                    try:
-                        trans_dict = self._parse_transaction(match_txn, line)
-                        transazioni_in_attesa.append(trans_dict)
-                    except Exception:
-                        continue
+            else:
+                # Assegna la targa alle transazioni in attesa
+                targa = m["targa"]
+                for trans_dict in transazioni_in_attesa:
+                    trans_dict["targa"] = targa
+                    # Chiave singola: un solo hash invece dei tre della tupla
+                    key = f"{trans_dict['data']}|{trans_dict['ora']}|{trans_dict['numero_scontrino']}"
+                    if key not in visti:
+                        visti.add(key)
+                        raccolti.append(trans_dict)
+
+                transazioni_in_attesa = []
 
         # Gestisci transazioni rimaste (senza targa)
         for trans_dict in transazioni_in_attesa:
             trans_dict["targa"] = "SCONOSCIUTA"
-            key = (trans_dict["data"], trans_dict["ora"], trans_dict["numero_scontrino"])
+            key = f"{trans_dict['data']}|{trans_dict['ora']}|{trans_dict['numero_scontrino']}"
             if key not in visti:
                 visti.add(key)
-                transactions.append(Transaction(**trans_dict))
+                raccolti.append(trans_dict)
 
-        return transactions
+        # model_construct salta la validazione pydantic: i campi sono già
+        # sanitizzati dal regex e dai normalizzatori
+        return [Transaction.model_construct(**trans_dict) for trans_dict in raccolti]
 
     def _trova_transazione(self, line: str):
         """
         Pattern regex per identificare una transazione Tamoil.
         Formato: S 8478 SACROFANO (RM) 674676 01/10/2025 09:55 1 Gasolio Self LT 61,92 101,49
         """
-        pattern = (
-            r"^S\s+"                            # Nota (S = Self pre-pay)
-            r"(\d+)\s+"                         # Codice PV
-            r"([A-Z\s()]+?)\s+"                 # Località (può contenere parentesi)
-            r"(\d+)\s+"                         # N° Autorizzazione (numero scontrino)
-            r"(\d{2}/\d{2}/\d{4})\s+"          # Data (DD/MM/YYYY)
-            r"(\d{2}:\d{2})\s+"                # Ora
-            r"(\d+)\s+"                         # KM
-            r"(.+?)\s+"                         # Prodotto (es: Gasolio Self, Gasolio)
-            r"LT\s+"                            # Unità di misura (sempre LT)
-            r"([\d,]+)\s+"                      # Quantità
-            r"([\d,]+)"                         # Importo
-        )
-        return re.search(pattern, line)
+        return _TXN_RE.search(line)
 
     def _parse_transaction(self, match, line: str) -> Dict[str, Any]:
         """Converte il match regex in un dizionario per Transaction"""
@@ -166,8 +203,7 @@ class TamoilExtractor(BaseExtractor):
         localita = localita_raw.strip()
         km = int(km_raw) if km_raw and km_raw != "1" else 0  # "1" indica KM non inseriti
         prodotto = self.normalizza_prodotto(prodotto_raw)
-        quantita = self.normalizza_numero(quantita_raw)
-        importo = self.normalizza_numero(importo_raw)
+        quantita, importo = self.normalizza_numeri(quantita_raw, importo_raw)
         prezzo_unitario = importo / quantita if quantita > 0 else 0.0
 
         return {
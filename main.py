@@ -7,15 +7,27 @@ Version 2.0.0 - Architettura modulare con estrattori multipli
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
+import asyncio
 import csv
+import hashlib
 import io
+import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 # Import nuova architettura estrattori
 from extractors.extractor_factory import ExtractorFactory
 
+# Pool di processi condiviso per l'estrazione CPU-bound (pdfplumber + regex):
+# i worker partono alla prima submit, non all'import
+EXECUTOR = ProcessPoolExecutor(max_workers=os.cpu_count())
+
+# Dimensione massima accettata per un singolo PDF
+MAX_PDF_SIZE = 50 * 1024 * 1024  # 50MB
+
 app = FastAPI(
     title="BeeBus Fatture Extractor",
     description="Estrazione automatica dati da fatture carburante (IP, Esso, Q8)",
@@ -33,6 +45,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compressione gzip per le risposte text-heavy (JSON batch, CSV): il testo
+# delle fatture comprime 5-10x, e sotto 1KB la risposta passa invariata
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Colonne del CSV unificato (condivise dagli endpoint /extract-csv e /download-csv)
+CSV_FIELDNAMES = [
+    "Targa", "Data_Rifornimento", "Ora_Rifornimento", "Chilometraggio",
+    "Litri", "Importo_Totale", "Fornitore", "Tipo_Rifornimento",
+    "Numero_Scontrino", "Localita"
+]
+
+
+def _iter_csv(all_records):
+    """
+    Genera il CSV riga per riga come bytes, riusando un singolo buffer.
+    Memoria costante invece di materializzare l'intero CSV in una stringa
+    e ricopiarla in un BytesIO per la risposta.
+    """
+    buf = io.StringIO()
+    # csv.writer su tuple già in ordine di colonna: evita il lookup per
+    # fieldname che DictWriter fa su ogni cella
+    writer = csv.writer(buf, delimiter=";")
+    writer.writerow(CSV_FIELDNAMES)
+    yield buf.getvalue().encode('utf-8')
+    buf.seek(0)
+    buf.truncate()
+    for record in all_records:
+        writer.writerow([record[field] for field in CSV_FIELDNAMES])
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+
+
 # Pydantic models per API documentation
 class ExtractionResult(BaseModel):
     status: str
@@ -94,6 +139,106 @@ def process_pdf_content(pdf_content: bytes, filename: str) -> dict:
             detail=f"Errore durante l'estrazione: {str(e)}"
         )
 
+async def _process_pdf_uploads(files: List[UploadFile]):
+    """
+    Legge tutti gli upload PDF in concorrenza e li processa in parallelo
+    sul pool di processi, senza bloccare l'event loop.
+
+    Args:
+        files: Lista di upload ricevuti dall'endpoint
+
+    Returns:
+        Tupla (results, errors): risultati di estrazione riusciti e lista di
+        dizionari {filename, error} per i file falliti
+    """
+    pdf_files = [f for f in files if f.filename.endswith('.pdf')]
+    if not pdf_files:
+        return [], []
+
+    results = []
+    errors = []
+
+    # Lettura concorrente degli upload, con limite di dimensione applicato
+    # durante la lettura: i file oltre soglia vengono scartati senza mai
+    # finire interi in RAM
+    read_outcomes = await asyncio.gather(
+        *(_read_pdf_limited(f) for f in pdf_files),
+        return_exceptions=True
+    )
+
+    da_processare = []
+    for f, content in zip(pdf_files, read_outcomes):
+        if isinstance(content, Exception):
+            errors.append({"filename": f.filename, "error": str(content)})
+        else:
+            da_processare.append((f, content))
+
+    # Deduplica per hash del contenuto: nei workflow da form capita spesso lo
+    # stesso PDF caricato più volte, e blake2b costa millisecondi contro i
+    # secondi di un parsing pdfplumber ripetuto
+    indice_unici = {}
+    unici = []
+    file_digest = []
+    for f, content in da_processare:
+        digest = hashlib.blake2b(content, digest_size=16).digest()
+        file_digest.append((f, digest))
+        if digest not in indice_unici:
+            indice_unici[digest] = len(unici)
+            unici.append((f, content))
+
+    # Estrazione CPU-bound sui processi worker (HTTPException non è
+    # picklabile: nel pool gira direttamente la Factory, che solleva ValueError)
+    loop = asyncio.get_running_loop()
+    outcomes = await asyncio.gather(
+        *(
+            loop.run_in_executor(EXECUTOR, ExtractorFactory.extract_from_pdf, content, f.filename)
+            for f, content in unici
+        ),
+        return_exceptions=True
+    )
+
+    for f, digest in file_digest:
+        outcome = outcomes[indice_unici[digest]]
+        if isinstance(outcome, Exception):
+            errors.append({"filename": f.filename, "error": str(outcome)})
+        elif outcome["filename"] != f.filename:
+            # Duplicato caricato con nome diverso: riusa il risultato
+            # correggendo solo il nome file
+            results.append({**outcome, "filename": f.filename})
+        else:
+            results.append(outcome)
+
+    return results, errors
+
+
+async def _read_pdf_limited(file: UploadFile) -> bytes:
+    """
+    Legge un upload a blocchi applicando MAX_PDF_SIZE durante la lettura.
+
+    Args:
+        file: Upload da leggere
+
+    Returns:
+        Contenuto binario completo del file
+
+    Raises:
+        ValueError: Se il file supera la dimensione massima
+    """
+    if file.size and file.size > MAX_PDF_SIZE:
+        raise ValueError("File troppo grande (max 50MB)")
+
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(1024 * 1024)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > MAX_PDF_SIZE:
+            raise ValueError("File troppo grande (max 50MB)")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
 # API ENDPOINTS
 
 @app.post("/extract", response_model=ExtractionResult)
@@ -110,7 +255,7 @@ async def extract_single_pdf(file: UploadFile = File(...)):
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="File deve essere PDF")
 
-    if file.size and file.size > 50 * 1024 * 1024:  # 50MB limit
+    if file.size and file.size > MAX_PDF_SIZE:
         raise HTTPException(status_code=400, detail="File troppo grande (max 50MB)")
 
     content = await file.read()
@@ -132,24 +277,10 @@ async def extract_multiple_pdfs(files: List[UploadFile] = File(...)):
     if len(files) > 10:
         raise HTTPException(status_code=400, detail="Max 10 files per batch")
 
-    results = []
-    total_records = 0
-    errors = []
-
-    for file in files:
-        if file.filename.endswith('.pdf'):
-            try:
-                content = await file.read()
-                result = process_pdf_content(content, file.filename)
-                results.append(result)
-                total_records += result["records_count"]
-            except HTTPException as e:
-                # Registra l'errore ma continua con gli altri file
-                errors.append({
-                    "filename": file.filename,
-                    "error": e.detail
-                })
-                continue
+    # Lettura concorrente + estrazione in parallelo sul pool di processi;
+    # i file falliti vengono registrati senza interrompere il batch
+    results, errors = await _process_pdf_uploads(files)
+    total_records = sum(result["records_count"] for result in results)
 
     batch_result = {
         "status": "success" if results else "error",
@@ -174,20 +305,13 @@ async def extract_and_download_csv(files: List[UploadFile] = File(...)):
     Returns:
         JSONResponse con CSV data e filename per download
     """
+    # Lettura concorrente + estrazione in parallelo sul pool di processi
+    results, errors = await _process_pdf_uploads(files)
     all_records = []
-    processed_count = 0
-    error_count = 0
-
-    for file in files:
-        if file.filename.endswith('.pdf'):
-            try:
-                content = await file.read()
-                result = process_pdf_content(content, file.filename)
-                all_records.extend(result["data"])
-                processed_count += 1
-            except Exception as e:
-                error_count += 1
-                continue
+    for result in results:
+        all_records.extend(result["data"])
+    processed_count = len(results)
+    error_count = len(errors)
 
     if not all_records:
         raise HTTPException(
@@ -195,19 +319,13 @@ async def extract_and_download_csv(files: List[UploadFile] = File(...)):
             detail=f"Nessun dato estratto. File processati: {processed_count}, Errori: {error_count}"
         )
 
-    # Genera CSV
+    # Genera CSV (qui serve la stringa completa: viaggia dentro il body JSON).
+    # csv.writer su righe già in ordine di colonna evita il lookup per
+    # fieldname che DictWriter fa su ogni cella
     output = io.StringIO()
-    fieldnames = [
-        "Targa", "Data_Rifornimento", "Ora_Rifornimento", "Chilometraggio",
-        "Litri", "Importo_Totale", "Fornitore", "Tipo_Rifornimento",
-        "Numero_Scontrino", "Localita"
-    ]
-
-    writer = csv.DictWriter(output, fieldnames=fieldnames, delimiter=";")
-    writer.writeheader()
-    writer.writerows(all_records)
-
-    # Return CSV as download
+    writer = csv.writer(output, delimiter=";")
+    writer.writerow(CSV_FIELDNAMES)
+    writer.writerows([record[field] for field in CSV_FIELDNAMES] for record in all_records)
     csv_content = output.getvalue()
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"beebus_rifornimenti_{timestamp}.csv"
@@ -234,21 +352,15 @@ async def download_csv_file(files: List[UploadFile] = File(...)):
     Returns:
         File CSV scaricabile direttamente (Content-Disposition: attachment)
     """
-    all_records = []
-    processed_count = 0
-    error_count = 0
     total_amount = 0.0
 
-    for file in files:
-        if file.filename.endswith('.pdf'):
-            try:
-                content = await file.read()
-                result = process_pdf_content(content, file.filename)
-                all_records.extend(result["data"])
-                processed_count += 1
-            except Exception as e:
-                error_count += 1
-                continue
+    # Lettura concorrente + estrazione in parallelo sul pool di processi
+    results, errors = await _process_pdf_uploads(files)
+    all_records = []
+    for result in results:
+        all_records.extend(result["data"])
+    processed_count = len(results)
+    error_count = len(errors)
 
     if not all_records:
         raise HTTPException(
@@ -264,26 +376,13 @@ async def download_csv_file(files: List[UploadFile] = File(...)):
         except (ValueError, TypeError):
             continue
 
-    # Genera CSV
-    output = io.StringIO()
-    fieldnames = [
-        "Targa", "Data_Rifornimento", "Ora_Rifornimento", "Chilometraggio",
-        "Litri", "Importo_Totale", "Fornitore", "Tipo_Rifornimento",
-        "Numero_Scontrino", "Localita"
-    ]
-
-    writer = csv.DictWriter(output, fieldnames=fieldnames, delimiter=";")
-    writer.writeheader()
-    writer.writerows(all_records)
-
-    # Prepara il file per il download
-    csv_content = output.getvalue()
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"beebus_rifornimenti_{timestamp}.csv"
 
-    # Restituisci come file scaricabile con metadati negli header
+    # Restituisci come file scaricabile con metadati negli header:
+    # il generatore produce il CSV riga per riga senza buffer intermedi
     return StreamingResponse(
-        io.BytesIO(csv_content.encode('utf-8')),
+        _iter_csv(all_records),
         media_type="text/csv; charset=utf-8",
         headers={
             "Content-Disposition": f"attachment; filename={filename}",
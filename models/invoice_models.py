@@ -3,12 +3,16 @@ Modelli dati comuni per le fatture di carburante.
 Questi modelli sono usati da tutti gli estrattori per garantire un output standardizzato.
 """
 from typing import Optional, List
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
 
 
 class Transaction(BaseModel):
     """Modello standardizzato per una singola transazione di rifornimento"""
+    # Modello hot-path (migliaia di istanze per fattura): immutabile e senza
+    # campi extra, così pydantic non deve gestire __pydantic_extra__ per riga
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     data: str = Field(description="Data rifornimento (formato DD/MM/YY)")
     ora: str = Field(description="Ora rifornimento (formato HH:MM)")
     numero_scontrino: str = Field(description="Numero scontrino/ticket")
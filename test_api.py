@@ -5,155 +5,262 @@ Testa l'estrazione da tutte le tipologie di fatture
 """
 import requests
 import json
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib3.util import Retry
+
+# MultipartEncoder (requests-toolbelt) se disponibile: alimenta il socket
+# direttamente dai file su disco a blocchi, invece di bufferizzare tutti i
+# PDF in memoria. Dipendenza opzionale: senza, si ricade sull'upload standard.
+try:
+    from requests_toolbelt import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
+# orjson (parser Rust) se disponibile: decodifica le risposte batch/CSV
+# 1.5-2x più velocemente dello stdlib. Dipendenza opzionale: senza, si
+# ricade su json.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Separatore di sezione precomputato: niente "="*60 (nuova str da 60 char)
+# ad ogni intestazione stampata
+_BAR = "=" * 60
 
 # Configurazione
 BASE_URL = "http://localhost:8000"
 FATTURE_DIR = Path("Fatture")
 
+# URL completi costruiti una sola volta all'import: niente f-string
+# (e relativa allocazione) ad ogni chiamata nei test
+URL_HEALTH = f"{BASE_URL}/health"
+URL_PROVIDERS = f"{BASE_URL}/supported-providers"
+URL_EXTRACT = f"{BASE_URL}/extract"
+URL_BATCH = f"{BASE_URL}/extract-batch"
+URL_DOWNLOAD_CSV = f"{BASE_URL}/download-csv"
+
+# Fatture di prova: lista costruita (e stat-ata) una sola volta all'import,
+# invece di ricreare i Path e rifare exists() in ogni test
+CANDIDATE_FATTURE = (
+    FATTURE_DIR / "Fattura IP.pdf",
+    FATTURE_DIR / "fattura esso.pdf",
+    FATTURE_DIR / "fattura q8.pdf"
+)
+EXISTING_FATTURE = tuple(f for f in CANDIDATE_FATTURE if f.exists())
+
+# Contenuto dei PDF letto una sola volta: i test singolo/batch/CSV riusano
+# gli stessi bytes invece di rileggere ogni fattura da disco per ogni test
+PDF_BYTES = {f.name: f.read_bytes() for f in EXISTING_FATTURE}
+
+# Sessione condivisa con keep-alive: la stessa connessione TCP viene riusata
+# da tutti i test invece di rifare l'handshake ad ogni chiamata
+SESSION = requests.Session()
+SESSION.headers["Connection"] = "keep-alive"
+# Accetta risposte compresse: il JSON batch e il CSV comprimono 5-10x,
+# requests decomprime in C in modo trasparente
+SESSION.headers["Accept-Encoding"] = "gzip, deflate"
+# Retry limitato con backoff: i blip 5xx durante il warmup del server non
+# abortiscono la suite, e con il keep-alive i tentativi riusano lo stesso
+# socket persistente
+_RETRY = Retry(
+    total=3,
+    backoff_factor=0.1,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset(["GET", "POST"])
+)
+SESSION.mount("http://", requests.adapters.HTTPAdapter(
+    max_retries=_RETRY, pool_connections=4, pool_maxsize=10
+))
+
+# Formato riga del riepilogo batch precompilato come bound method: la spec
+# di formato viene analizzata una volta sola invece che ad ogni file
+_SUMMARY_FMT = "  • {fn}: {n} record, €{a:.2f}, Fornitore: {p}".format
+
+def _json(response):
+    """Decodifica il body JSON di una risposta (orjson se disponibile)"""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+def _print_json(data):
+    """
+    Stampa JSON indentato. Con orjson scrive i bytes UTF-8 direttamente su
+    stdout.buffer: niente str intermedia né ri-codifica nel TextIOWrapper.
+    """
+    if orjson is not None:
+        sys.stdout.flush()  # mantieni l'ordine rispetto alle print precedenti
+        sys.stdout.buffer.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        sys.stdout.buffer.write(b"\n")
+    else:
+        print(json.dumps(data, indent=2, ensure_ascii=False))
+
+def _post_pdfs(url):
+    """
+    Invia tutte le fatture in cache come upload multipart all'URL dato.
+    Unico punto per la sequenza build-campi + POST condivisa dai test
+    batch e CSV: i bytes sono già in RAM e BytesIO mantiene l'invio a
+    blocchi dell'encoder senza rileggere nulla da disco.
+    """
+    campi = [
+        ('files', (name, io.BytesIO(data), 'application/pdf'))
+        for name, data in PDF_BYTES.items()
+    ]
+    if MultipartEncoder is not None:
+        encoder = MultipartEncoder(fields=campi)
+        return SESSION.post(
+            url,
+            data=encoder,
+            headers={'Content-Type': encoder.content_type}
+        )
+    return SESSION.post(url, files=campi)
+
 def print_section(title):
-    """Stampa una sezione formattata"""
-    print("\n" + "="*60)
-    print(f"🔍 {title}")
-    print("="*60)
+    """Stampa una sezione formattata (una sola write invece di tre print)"""
+    sys.stdout.write(f"\n{_BAR}\n🔍 {title}\n{_BAR}\n")
 
 def test_health():
     """Test health check"""
     print_section("Health Check")
-    response = requests.get(f"{BASE_URL}/health")
+    response = SESSION.get(URL_HEALTH)
     print(f"Status: {response.status_code}")
-    print(json.dumps(response.json(), indent=2, ensure_ascii=False))
+    _print_json(_json(response))
 
 def test_supported_providers():
     """Test lista fornitori supportati"""
     print_section("Fornitori Supportati")
-    response = requests.get(f"{BASE_URL}/supported-providers")
-    print(json.dumps(response.json(), indent=2, ensure_ascii=False))
+    response = SESSION.get(URL_PROVIDERS)
+    _print_json(_json(response))
 
 def test_single_extraction(file_path):
     """Test estrazione singola fattura"""
-    print_section(f"Estrazione: {file_path.name}")
-
-    if not file_path.exists():
-        print(f"❌ File non trovato: {file_path}")
+    # Accumula l'output e stampa in un colpo solo: le estrazioni singole
+    # girano in parallelo e le righe non devono mescolarsi tra thread
+    out = ["\n" + _BAR, f"🔍 Estrazione: {file_path.name}", _BAR]
+    data = None
+
+    contenuto = PDF_BYTES.get(file_path.name)
+    if contenuto is None:
+        out.append(f"❌ File non trovato: {file_path}")
+        print("\n".join(out))
         return None
 
-    with open(file_path, 'rb') as f:
-        files = {'file': (file_path.name, f, 'application/pdf')}
-        response = requests.post(f"{BASE_URL}/extract", files=files)
+    files = {'file': (file_path.name, contenuto, 'application/pdf')}
+    response = SESSION.post(URL_EXTRACT, files=files)
 
-    print(f"Status: {response.status_code}")
+    out.append(f"Status: {response.status_code}")
 
     if response.status_code == 200:
-        data = response.json()
-        print(f"✅ Fornitore identificato: {data.get('fornitore', 'N/A')}")
-        print(f"✅ Record estratti: {data.get('records_count', 0)}")
-        print(f"✅ Totale importo: €{data.get('total_amount', 0):.2f}")
+        data = _json(response)
+        out.append(f"✅ Fornitore identificato: {data.get('fornitore', 'N/A')}")
+        out.append(f"✅ Record estratti: {data.get('records_count', 0)}")
+        out.append(f"✅ Totale importo: €{data.get('total_amount', 0):.2f}")
 
-        # Mostra prime 3 transazioni
+        # Mostra prime 3 transazioni: colonne materializzate una volta
+        # (un tuple-build per record invece di tre lookup per riga formattata)
         if data.get('data'):
-            print("\n📋 Prime 3 transazioni:")
-            for i, record in enumerate(data['data'][:3], 1):
-                print(f"  {i}. {record.get('Data_Rifornimento')} - "
-                      f"Targa: {record.get('Targa')} - "
-                      f"€{record.get('Importo_Totale', 0):.2f}")
-        return data
+            out.append("\n📋 Prime 3 transazioni:")
+            datas, targhe, importi = zip(*(
+                (r.get('Data_Rifornimento'), r.get('Targa'), r.get('Importo_Totale', 0))
+                for r in data['data'][:3]
+            ))
+            for i, (d, targa, importo) in enumerate(zip(datas, targhe, importi), 1):
+                out.append(f"  {i}. {d} - Targa: {targa} - €{importo:.2f}")
     else:
-        print(f"❌ Errore: {response.text}")
-        return None
+        out.append(f"❌ Errore: {response.text}")
+
+    print("\n".join(out))
+    return data
 
 def test_batch_extraction():
     """Test estrazione batch di tutte le fatture"""
-    print_section("Estrazione Batch (tutte le fatture)")
+    # Accumula l'output e stampa in un colpo solo: il test gira in parallelo
+    # con l'export CSV e le righe non devono mescolarsi tra thread
+    out = ["\n" + _BAR, "🔍 Estrazione Batch (tutte le fatture)", _BAR]
 
-    fatture = [
-        FATTURE_DIR / "Fattura IP.pdf",
-        FATTURE_DIR / "fattura esso.pdf",
-        FATTURE_DIR / "fattura q8.pdf"
-    ]
-
-    # Filtra solo i file esistenti
-    existing_files = [f for f in fatture if f.exists()]
-
-    if not existing_files:
-        print("❌ Nessuna fattura trovata")
+    if not PDF_BYTES:
+        out.append("❌ Nessuna fattura trovata")
+        print("\n".join(out))
         return
 
-    files = [
-        ('files', (f.name, open(f, 'rb'), 'application/pdf'))
-        for f in existing_files
-    ]
-
-    response = requests.post(f"{BASE_URL}/extract-batch", files=files)
+    response = _post_pdfs(URL_BATCH)
 
-    # Chiudi i file
-    for _, (_, file_obj, _) in files:
-        file_obj.close()
-
-    print(f"Status: {response.status_code}")
+    out.append(f"Status: {response.status_code}")
 
     if response.status_code == 200:
-        data = response.json()
-        print(f"✅ File processati: {data.get('processed_files', 0)}")
-        print(f"✅ Totale record: {data.get('total_records', 0)}")
+        data = _json(response)
+        out.append(f"✅ File processati: {data.get('processed_files', 0)}")
+        out.append(f"✅ Totale record: {data.get('total_records', 0)}")
 
         if data.get('results'):
-            print("\n📊 Riepilogo per file:")
-            for result in data['results']:
-                print(f"  • {result['filename']}: "
-                      f"{result['records_count']} record, "
-                      f"€{result['total_amount']:.2f}, "
-                      f"Fornitore: {result.get('fornitore', 'N/A')}")
+            out.append("\n📊 Riepilogo per file:\n" + "\n".join(
+                _SUMMARY_FMT(
+                    fn=result['filename'],
+                    n=result['records_count'],
+                    a=result['total_amount'],
+                    p=result.get('fornitore', 'N/A')
+                )
+                for result in data['results']
+            ))
     else:
-        print(f"❌ Errore: {response.text}")
+        out.append(f"❌ Errore: {response.text}")
+
+    print("\n".join(out))
 
 def test_csv_export():
     """Test esportazione CSV"""
-    print_section("Esportazione CSV")
-
-    fatture = [
-        FATTURE_DIR / "Fattura IP.pdf",
-        FATTURE_DIR / "fattura esso.pdf",
-        FATTURE_DIR / "fattura q8.pdf"
-    ]
-
-    existing_files = [f for f in fatture if f.exists()]
+    # Accumula l'output e stampa in un colpo solo: il test gira in parallelo
+    # con il batch e le righe non devono mescolarsi tra thread
+    out = ["\n" + _BAR, "🔍 Esportazione CSV", _BAR]
 
-    if not existing_files:
-        print("❌ Nessuna fattura trovata")
+    if not PDF_BYTES:
+        out.append("❌ Nessuna fattura trovata")
+        print("\n".join(out))
         return
 
-    files = [
-        ('files', (f.name, open(f, 'rb'), 'application/pdf'))
-        for f in existing_files
-    ]
+    # /download-csv risponde text/csv puro: niente decode JSON del payload.
+    # Se il server risponde comunque JSON (vecchio formato), si ricade sul
+    # parsing di csv_data.
+    response = _post_pdfs(URL_DOWNLOAD_CSV)
 
-    response = requests.post(f"{BASE_URL}/extract-csv", files=files)
+    if response.status_code == 200 and response.headers.get('Content-Type', '').startswith('text/csv'):
+        # Percorso veloce: i bytes del CSV vanno su disco così come sono,
+        # i metadati arrivano dagli header
+        filename = "beebus_rifornimenti_test.csv"
+        output_path = Path(filename)
+        output_path.write_bytes(response.content)
 
-    for _, (_, file_obj, _) in files:
-        file_obj.close()
+        out.append(f"✅ CSV salvato: {output_path}")
+        out.append(f"✅ Totale record: {response.headers.get('X-Total-Records', 'N/A')}")
+        out.append(f"✅ File processati: {response.headers.get('X-Processed-Files', 'N/A')}")
 
-    if response.status_code == 200:
-        data = response.json()
+        lines = response.content.split(b'\n', 5)[:5]
+        out.append("\n📄 Prime righe del CSV:\n" + "\n".join(f"  {line.decode('utf-8', 'replace')}" for line in lines))
+    elif response.status_code == 200:
+        data = _json(response)
         csv_content = data.get('csv_data', '')
         filename = data.get('filename', 'output.csv')
 
-        # Salva il CSV
+        # Salva il CSV: una sola write binaria, senza ripassare dal
+        # layer di codifica di TextIOWrapper
         output_path = Path(filename)
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(csv_content)
-
-        print(f"✅ CSV salvato: {output_path}")
-        print(f"✅ Totale record: {data.get('total_records', 0)}")
-        print(f"✅ File processati: {data.get('processed_files', 0)}")
-
-        # Mostra prime righe
-        lines = csv_content.split('\n')[:5]
-        print("\n📄 Prime righe del CSV:")
-        for line in lines:
-            print(f"  {line}")
+        output_path.write_bytes(csv_content.encode('utf-8'))
+
+        out.append(f"✅ CSV salvato: {output_path}")
+        out.append(f"✅ Totale record: {data.get('total_records', 0)}")
+        out.append(f"✅ File processati: {data.get('processed_files', 0)}")
+
+        # Mostra prime righe: split limitato, la scansione si ferma al
+        # quinto newline invece di allocare una lista con tutte le righe
+        lines = csv_content.split('\n', 5)[:5]
+        out.append("\n📄 Prime righe del CSV:\n" + "\n".join(f"  {line}" for line in lines))
     else:
-        print(f"❌ Errore: {response.text}")
+        out.append(f"❌ Errore: {response.text}")
+
+    print("\n".join(out))
 
 def main():
     """Esegue tutti i test"""
@@ -166,28 +273,29 @@ def main():
         # Test 2: Fornitori supportati
         test_supported_providers()
 
-        # Test 3: Estrazione singole fatture
-        test_single_extraction(FATTURE_DIR / "Fattura IP.pdf")
-        test_single_extraction(FATTURE_DIR / "fattura esso.pdf")
-        test_single_extraction(FATTURE_DIR / "fattura q8.pdf")
-
-        # Test 4: Batch
-        test_batch_extraction()
+        # Test 3: Estrazione singole fatture, lanciate in parallelo:
+        # il wall-clock scende a ~max(t_i) invece della somma dei tre upload
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(test_single_extraction, CANDIDATE_FATTURE))
 
-        # Test 5: CSV export
-        test_csv_export()
+        # Test 4+5: batch e export CSV in parallelo — endpoint indipendenti
+        # con gli stessi input, le due pipeline di estrazione lato server
+        # si sovrappongono sui due socket del pool keep-alive
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            fut_batch = executor.submit(test_batch_extraction)
+            fut_csv = executor.submit(test_csv_export)
+            fut_batch.result()
+            fut_csv.result()
 
-        print("\n" + "="*60)
-        print("✅ Tutti i test completati!")
-        print("="*60 + "\n")
+        sys.stdout.write(f"\n{_BAR}\n✅ Tutti i test completati!\n{_BAR}\n\n")
 
     except requests.exceptions.ConnectionError:
         print("\n❌ ERRORE: Impossibile connettersi al server!")
         print("Assicurati che il server sia avviato con: python main.py")
-        print("="*60 + "\n")
+        print(_BAR + "\n")
     except Exception as e:
         print(f"\n❌ ERRORE: {e}")
-        print("="*60 + "\n")
+        print(_BAR + "\n")
 
 if __name__ == "__main__":
     main()
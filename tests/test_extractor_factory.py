@@ -0,0 +1,132 @@
+"""
+Test suite per ExtractorFactory.extract_batch e parità sui PDF di esempio
+Verifica il contratto del batch (ordine, errori) e i conteggi noti
+"""
+import os
+import pytest
+from pathlib import Path
+from extractors.extractor_factory import ExtractorFactory
+
+# PDF di esempio inclusi nel repository
+FATTURE_DIR = Path(__file__).parent.parent / "Fatture"
+
+
+def _read_fattura(nome):
+    """Contenuto di un PDF di esempio, o skip se non presente"""
+    pdf_path = FATTURE_DIR / nome
+    if not pdf_path.exists():
+        pytest.skip(f"PDF non trovato: {pdf_path}")
+    return pdf_path.read_bytes()
+
+
+class TestExtractBatch:
+    """Test per il contratto di ExtractorFactory.extract_batch"""
+
+    def test_empty_batch(self):
+        """Un batch vuoto restituisce una lista vuota senza avviare il pool"""
+        assert ExtractorFactory.extract_batch([]) == []
+
+    def test_batch_preserves_input_order(self):
+        """I risultati devono essere nello stesso ordine degli item in input"""
+        contenuto_ip = _read_fattura("Fattura IP.pdf")
+        contenuto_q8 = _read_fattura("fattura q8.pdf")
+
+        items = [
+            (contenuto_q8, "primo.pdf"),
+            (contenuto_ip, "secondo.pdf"),
+            (contenuto_q8, "terzo.pdf"),
+        ]
+        results = ExtractorFactory.extract_batch(items, max_workers=2)
+
+        assert [r["filename"] for r in results] == ["primo.pdf", "secondo.pdf", "terzo.pdf"]
+
+    def test_batch_error_becomes_dict(self):
+        """Un file non riconosciuto produce un dizionario di errore, non un raise"""
+        results = ExtractorFactory.extract_batch(
+            [(b"questo non e' un PDF", "invalido.pdf")],
+            max_workers=1
+        )
+
+        assert len(results) == 1
+        errore = results[0]
+        assert errore["status"] == "error"
+        assert errore["filename"] == "invalido.pdf"
+        assert errore["records_count"] == 0
+        assert errore["data"] == []
+        assert errore["fornitore"] is None
+        assert errore["message"]
+
+    def test_batch_mixes_errors_and_successes(self):
+        """Un file invalido non deve interrompere l'estrazione degli altri"""
+        contenuto_ip = _read_fattura("Fattura IP.pdf")
+
+        items = [
+            (b"non un PDF", "rotto.pdf"),
+            (contenuto_ip, "ip.pdf"),
+        ]
+        results = ExtractorFactory.extract_batch(items, max_workers=2)
+
+        assert results[0]["status"] == "error"
+        assert results[1]["status"] == "success"
+        assert results[1]["records_count"] > 0
+
+
+class TestSampleParity:
+    """
+    Parità sui PDF di esempio del repository: i conteggi sono i valori noti
+    della baseline e devono restare stabili attraverso le ottimizzazioni.
+    """
+
+    # Targhe attese nella fattura IP di esempio: l'assegnazione targa è la
+    # parte più fragile dell'estrazione (dipende dalla ricostruzione delle
+    # righe "Totale carta ... TARGA") e deve essere pinnata per intero
+    IP_TARGHE = {
+        "EL934BA", "EM647VW", "FB333FP", "FE206YK", "FJ108FM", "FK445ZJ",
+        "FP059SR", "FS544TP", "FW881GT", "FW997GT", "FX184GX", "FZ463DT",
+        "GF927EW", "GH803WV", "GV551CL", "GV552CL", "GV871RH",
+    }
+
+    def test_ip_sample_counts(self):
+        """Fattura IP: 43 transazioni per 7251.77 EUR su 17 targhe"""
+        result = ExtractorFactory.extract_from_pdf(
+            _read_fattura("Fattura IP.pdf"), "Fattura IP.pdf"
+        )
+
+        assert result["status"] == "success"
+        assert result["fornitore"] == "IP"
+        assert result["records_count"] == 43
+        totale = sum(r["Importo_Totale"] for r in result["data"])
+        assert abs(totale - 7251.77) < 0.01
+
+        # Ogni riga deve avere una targa reale: un degrado della
+        # ricostruzione righe produce "SCONOSCIUTA" senza cambiare né il
+        # numero di record né il totale
+        targhe = {r["Targa"] for r in result["data"]}
+        assert targhe == self.IP_TARGHE
+
+    def test_q8_sample_counts(self):
+        """Fattura Q8: 9 transazioni per 616.36 EUR"""
+        result = ExtractorFactory.extract_from_pdf(
+            _read_fattura("fattura q8.pdf"), "fattura q8.pdf"
+        )
+
+        assert result["status"] == "success"
+        assert result["fornitore"] == "Q8"
+        assert result["records_count"] == 9
+        totale = sum(r["Importo_Totale"] for r in result["data"])
+        assert abs(totale - 616.36) < 0.01
+
+    def test_esso_sample_identified(self):
+        """
+        Fattura Esso: identificata come WEX. Il layout righe di questo
+        esemplare (senza "DI" né targa) non è quello supportato
+        dall'estrattore, quindi la baseline estrae 0 transazioni: il pin
+        va aggiornato se il formato viene supportato.
+        """
+        result = ExtractorFactory.extract_from_pdf(
+            _read_fattura("fattura esso.pdf"), "fattura esso.pdf"
+        )
+
+        assert result["status"] == "success"
+        assert result["fornitore"] == "WEX"
+        assert result["records_count"] == 0
@@ -0,0 +1,111 @@
+"""
+Test suite per gli helper degli endpoint in main.py
+Verifica il limite di dimensione in lettura e la deduplica degli upload
+"""
+import asyncio
+import io
+import pytest
+from pathlib import Path
+from fastapi import UploadFile
+
+import main
+from main import _process_pdf_uploads, _read_pdf_limited
+
+# PDF di esempio inclusi nel repository
+FATTURE_DIR = Path(__file__).parent.parent / "Fatture"
+
+
+def _upload(contenuto, nome, size=None):
+    """Costruisce un UploadFile in memoria come quelli ricevuti dagli endpoint"""
+    return UploadFile(io.BytesIO(contenuto), filename=nome, size=size)
+
+
+def _read_fattura(nome):
+    """Contenuto di un PDF di esempio, o skip se non presente"""
+    pdf_path = FATTURE_DIR / nome
+    if not pdf_path.exists():
+        pytest.skip(f"PDF non trovato: {pdf_path}")
+    return pdf_path.read_bytes()
+
+
+class TestReadPdfLimited:
+    """Test per il limite di dimensione applicato durante la lettura"""
+
+    def test_small_file_read_whole(self):
+        """Un file sotto soglia viene letto per intero"""
+        contenuto = b"%PDF-" + b"x" * 100
+        letto = asyncio.run(_read_pdf_limited(_upload(contenuto, "ok.pdf")))
+        assert letto == contenuto
+
+    def test_declared_size_over_limit_fails_fast(self, monkeypatch):
+        """Se la dimensione dichiarata supera la soglia si fallisce subito"""
+        monkeypatch.setattr(main, "MAX_PDF_SIZE", 1024)
+        upload = _upload(b"x" * 10, "grande.pdf", size=2048)
+        with pytest.raises(ValueError, match="troppo grande"):
+            asyncio.run(_read_pdf_limited(upload))
+
+    def test_streamed_size_over_limit_fails(self, monkeypatch):
+        """Il limite vale anche senza size dichiarata, durante la lettura"""
+        monkeypatch.setattr(main, "MAX_PDF_SIZE", 1024)
+        upload = _upload(b"x" * 4096, "grande.pdf")
+        with pytest.raises(ValueError, match="troppo grande"):
+            asyncio.run(_read_pdf_limited(upload))
+
+
+class TestProcessPdfUploads:
+    """Test per lettura concorrente, deduplica e contratto errori"""
+
+    def test_non_pdf_filtered_out(self):
+        """Gli upload senza estensione .pdf vengono ignorati"""
+        results, errors = asyncio.run(
+            _process_pdf_uploads([_upload(b"testo", "note.txt")])
+        )
+        assert results == []
+        assert errors == []
+
+    def test_invalid_pdf_reported_as_error(self):
+        """Un PDF non riconosciuto finisce negli errori con il suo filename"""
+        results, errors = asyncio.run(
+            _process_pdf_uploads([_upload(b"non un PDF", "rotto.pdf")])
+        )
+
+        assert results == []
+        assert len(errors) == 1
+        assert errors[0]["filename"] == "rotto.pdf"
+        assert errors[0]["error"]
+
+    def test_duplicate_content_deduplicated_with_filename_fixup(self):
+        """
+        Lo stesso contenuto caricato due volte con nomi diversi viene
+        estratto una sola volta, ma ogni upload riceve un risultato con
+        il proprio filename
+        """
+        contenuto = _read_fattura("Fattura IP.pdf")
+        uploads = [
+            _upload(contenuto, "copia_a.pdf"),
+            _upload(contenuto, "copia_b.pdf"),
+        ]
+
+        results, errors = asyncio.run(_process_pdf_uploads(uploads))
+
+        assert errors == []
+        assert [r["filename"] for r in results] == ["copia_a.pdf", "copia_b.pdf"]
+        # Stesso contenuto, stessa estrazione
+        assert results[0]["records_count"] == results[1]["records_count"] > 0
+
+    def test_oversized_upload_reported_not_raised(self, monkeypatch):
+        """Un file oltre soglia va negli errori senza interrompere gli altri"""
+        contenuto = _read_fattura("fattura q8.pdf")
+        # Soglia calibrata: il PDF valido passa, il file fittizio più grande no
+        monkeypatch.setattr(main, "MAX_PDF_SIZE", len(contenuto))
+        uploads = [
+            _upload(b"x" * (len(contenuto) + 1), "enorme.pdf"),
+            _upload(contenuto, "q8.pdf"),
+        ]
+
+        results, errors = asyncio.run(_process_pdf_uploads(uploads))
+
+        assert [r["filename"] for r in results] == ["q8.pdf"]
+        assert len(errors) == 1
+        assert errors[0]["filename"] == "enorme.pdf"
+        assert "troppo grande" in errors[0]["error"]